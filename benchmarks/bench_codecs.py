@@ -0,0 +1,69 @@
+'''
+Micro-benchmark of the decompression codecs n_machine can read the data dumps with.
+
+Writes the same synthetic month of comments once per codec and times reading it back line by line
+with n_machine.readers, reporting the throughput in MB/s of decompressed and of compressed data.
+
+Usage:
+poetry run python benchmarks/bench_codecs.py [--lines N] [--threads N]
+'''
+
+import os
+import bz2
+import gzip
+import lzma
+import time
+import argparse
+import tempfile
+
+from zstandard import ZstdCompressor
+
+from synthetic import synthetic_lines
+
+from n_machine.readers import CODECS, read_raw_lines, threaded_command
+
+
+COMPRESSORS = {
+    '.zst': lambda data: ZstdCompressor(level=3).compress(data),
+    '.xz': lzma.compress,
+    '.bz2': bz2.compress,
+    '.gz': gzip.compress,
+    '': lambda data: data,
+}
+
+
+def time_reading(file: str, threads: int) -> tuple:
+    """Read a dump once, returning the seconds it took and the number of lines."""
+    start = time.perf_counter()
+    count = sum(1 for _ in read_raw_lines(file, threads=threads))
+    return time.perf_counter() - start, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the read throughput of the data dump codecs")
+    parser.add_argument('--lines', type=int, default=200000, help="Number of comments in the synthetic dump.")
+    parser.add_argument('--threads', type=int, default=4, help="Threads for the codecs that support threaded decompression.")
+    args = parser.parse_args()
+
+    data = synthetic_lines(args.lines)
+    print(f"{args.lines:,} lines, {len(data) / 1e6:.1f} MB decompressed")
+    print(f"{'codec':<12}{'threads':>8}{'ratio':>8}{'MB/s':>10}{'compr. MB/s':>14}{'lines/s':>12}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for ending in CODECS:
+            file = os.path.join(tmp, "RC_2021-01" + ending)
+            with open(file, 'wb') as outfile:
+                outfile.write(COMPRESSORS[ending](data))
+            size = os.path.getsize(file)
+
+            for threads in sorted({1, args.threads}):
+                if threads > 1 and threaded_command(ending, threads) is None:
+                    continue
+                seconds, count = time_reading(file, threads)
+                assert count == args.lines
+                print(f"{ending or 'plain':<12}{threads:>8}{len(data) / size:>8.1f}{len(data) / seconds / 1e6:>10.1f}"
+                      f"{size / seconds / 1e6:>14.1f}{count / seconds:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+'''
+Micro-benchmark of filtering comment lines one by one against the vectorised batch filtering of --batch_size.
+
+Both paths filter the same synthetic comments for baseline 1, baseline 2, and both at once, against made-up comparison data from benchmarks/synthetic.py,
+and must agree on every comment. Reports lines per second for the per-row path and for each batch size.
+
+Usage:
+poetry run python benchmarks/bench_filtering.py [--lines N] [--batch_sizes N [N ...]]
+'''
+
+import time
+import argparse
+
+from synthetic import synthetic_lines, synthetic_resources
+
+from n_machine import main as n_machine
+from n_machine.stats import Stats
+
+
+def time_filtering(lines: list, args: argparse.Namespace, filters: list, block_size: int) -> tuple:
+    """Filter all lines in blocks, returning the seconds it took and the relevant comments."""
+    stats = Stats()
+    prefilter = n_machine.make_prefilter(filters, stats.rejections)
+    decode = n_machine.comment_decoder(args)
+    start = time.perf_counter()
+    comments = list()
+    for i in range(0, len(lines), block_size):
+        comments.extend(n_machine.filter_lines(lines[i:i + block_size], args, filters, prefilter, decode, stats))
+    return time.perf_counter() - start, comments
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-row and vectorised filtering of comment lines")
+    parser.add_argument('--lines', type=int, default=200000, help="Number of comments to filter.")
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[10000, 50000, 100000], help="Batch sizes to try.")
+    args = parser.parse_args()
+
+    n_machine.resources = synthetic_resources()
+    lines = [line for line in synthetic_lines(args.lines).split(b"\n") if line]
+    search = n_machine.define_parser().parse_args(['--input', '.', '--popularity', '0'])
+    n_machine.decoding.use_backend(search.json_backend)
+    print(f"{len(lines):,} lines")
+    print(f"{'baselines':<12}{'relevant':>10}{'path':>14}{'lines/s':>12}{'speedup':>10}")
+
+    for baselines in ([1], [2], [1, 2]):
+        filters = [(n_machine.resources.subs, baseline_nr) for baseline_nr in baselines]
+        name = ' '.join(str(baseline_nr) for baseline_nr in baselines)
+
+        search.batch_size = None
+        seconds, expected = time_filtering(lines, search, filters, 10000)
+        print(f"{name:<12}{len(expected):>10,}{'per row':>14}{len(lines) / seconds:>12,.0f}{1:>10.2f}")
+
+        for batch_size in args.batch_sizes:
+            search.batch_size = batch_size
+            batch_seconds, comments = time_filtering(lines, search, filters, batch_size)
+            assert [(comment.id, matches) for comment, matches in comments] == [(comment.id, matches) for comment, matches in expected]
+            print(f"{name:<12}{len(comments):>10,}{f'batch {batch_size}':>14}{len(lines) / batch_seconds:>12,.0f}{seconds / batch_seconds:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
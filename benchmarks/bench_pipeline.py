@@ -0,0 +1,179 @@
+'''
+Benchmark of n_machine's pipeline, stage by stage and end to end, on a synthetic month.
+
+Writes a synthetic month with benchmarks/synthetic.py and times each stage on its own:
+reading the raw lines with and without prefetching, reading and decoding them, relevant() with and without a comment regex,
+the reservoir updates, generate_k(), and extract(), followed by whole runs of process_month() for baseline 1, baseline 2, and both at once,
+and for baseline 1 with prefetching.
+Every stage is reported in lines/s and in MB/s of the decompressed lines it went through.
+
+The results can be saved as a baseline, and later runs compared against it, flagging every stage that got slower
+by more than the tolerance. benchmarks/baseline.json is the baseline of the current code with the default arguments;
+baselines are only comparable on the same machine and with the same --lines.
+
+Usage:
+poetry run python benchmarks/bench_pipeline.py [--lines N] [--repeat N] [--save benchmarks/baseline.json] [--compare benchmarks/baseline.json]
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+from synthetic import synthetic_resources, write_month
+
+from n_machine import main as n_machine
+from n_machine.readers import PREFETCH_CHUNK_SIZE, read_lines_zst
+from n_machine.reservoir import RandomStream, Reservoir
+from n_machine.writers import open_writer
+
+
+YEAR, MONTH = 2021, 1
+PREFETCH = 4
+
+
+def best_of(repeat: int, stage) -> tuple:
+    """Run a stage several times, returning its fastest time along with what it returned."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = stage()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def search_args(output: str, baselines: list) -> argparse.Namespace:
+    """Return the arguments of a run over the synthetic month, as handle_args() would complete them."""
+    argv = ['--input', os.path.dirname(output), '--output', output, '--popularity', '0', '--baseline_nr'] + [str(nr) for nr in baselines]
+    args = n_machine.define_parser().parse_args(argv)
+    args.output_format = 'csv'
+    args.checkpoint_interval = 0
+    return args
+
+
+def run_stages(file: str, data: bytes, output: str, repeat: int) -> dict:
+    """Time every stage on the month in file, returning {stage: (seconds, lines, bytes)}."""
+    results = dict()
+    lines = [line for line in data.split(b'\n') if line]
+
+    seconds, count = best_of(repeat, lambda: sum(1 for _ in read_lines_zst(file)))
+    results['read_lines_zst'] = (seconds, count, len(data))
+    seconds, count = best_of(repeat, lambda: sum(1 for _ in read_lines_zst(file, PREFETCH_CHUNK_SIZE, prefetch=PREFETCH)))
+    results[f'read_lines_zst (prefetch {PREFETCH})'] = (seconds, count, len(data))
+
+    seconds, comments = best_of(repeat, lambda: list(n_machine.read_redditfile(file)))
+    results['read_redditfile (dicts)'] = (seconds, len(comments), len(data))
+
+    args = search_args(output, [1])
+    decode = n_machine.comment_decoder(args)
+    seconds, comments = best_of(repeat, lambda: list(n_machine.read_redditfile(file, decode=decode)))
+    results['read_redditfile (structs)'] = (seconds, len(comments), len(data))
+
+    subs = n_machine.resources.subs
+    for baseline_nr in (1, 2):
+        seconds, _ = best_of(repeat, lambda: [comment for comment in comments if n_machine.relevant(comment, args, subs, baseline_nr)])
+        results[f'relevant (baseline {baseline_nr})'] = (seconds, len(comments), len(data))
+    search = search_args(output, [2])
+    search.commentregex = r"\bpronouns?\b|what you said"
+    seconds, _ = best_of(repeat, lambda: [comment for comment in comments if n_machine.relevant(comment, search, subs, 2)])
+    results['relevant (baseline 2, regex)'] = (seconds, len(comments), len(data))
+    # the later stages only see the comments baseline 2 keeps, which are most of them
+    kept = [(line, comment) for line, comment in zip(lines, comments) if n_machine.relevant(comment, args, subs, 2)]
+    kept_bytes = sum(len(line) + 1 for line, _ in kept)
+    kept = [comment for _, comment in kept]
+
+    def update_reservoirs():
+        reservoir = Reservoir(len(kept) // 10, RandomStream(args.seed, YEAR, MONTH))
+        for comment in kept:
+            reservoir.add(comment)
+        return reservoir
+    seconds, _ = best_of(repeat, update_reservoirs)
+    results['reservoir updates'] = (seconds, len(kept), kept_bytes)
+
+    seconds, _ = best_of(repeat, lambda: [n_machine.generate_k(comment['subreddit'], YEAR, MONTH) for comment in comments])
+    results['generate_k'] = (seconds, len(comments), len(data))
+
+    def extract_all():
+        with open_writer(os.path.join(output, "extract.csv"), 'csv') as writer:
+            for comment in kept:
+                n_machine.extract(args, comment, writer)
+    seconds, _ = best_of(repeat, extract_all)
+    results['extract'] = (seconds, len(kept), kept_bytes)
+
+    for baselines in ([1], [2], [1, 2]):
+        run_args = search_args(output, baselines)
+        seconds, _ = best_of(repeat, lambda: n_machine.process_month(os.path.basename(file), run_args))
+        results[f"end to end (baseline {' '.join(str(nr) for nr in baselines)})"] = (seconds, len(lines), len(data))
+    run_args = search_args(output, [1])
+    run_args.prefetch = PREFETCH
+    seconds, _ = best_of(repeat, lambda: n_machine.process_month(os.path.basename(file), run_args))
+    results[f"end to end (baseline 1, prefetch {PREFETCH})"] = (seconds, len(lines), len(data))
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Print each stage's throughput relative to the baseline, returning the stages that regressed."""
+    regressions = list()
+    print(f"\n{'stage':<38}{'lines/s':>14}{'baseline':>14}{'ratio':>8}")
+    for stage, (seconds, lines, _) in results.items():
+        if stage not in baseline['stages']:
+            continue
+        rate, expected = lines / seconds, baseline['stages'][stage]['lines_per_s']
+        flag = ""
+        if rate < expected * (1 - tolerance):
+            flag = "  REGRESSION"
+            regressions.append(stage)
+        print(f"{stage:<38}{rate:>14,.0f}{expected:>14,.0f}{rate / expected:>8.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time n_machine's pipeline stage by stage on a synthetic month")
+    parser.add_argument('--lines', type=int, default=200000, help="Number of comments in the synthetic month.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic month and comparison data.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of each stage, of which the fastest counts.")
+    parser.add_argument('--json_backend', default='auto', help="Decoding backend, as in n_machine.")
+    parser.add_argument('--save', help="Save the results as a baseline to this JSON file.")
+    parser.add_argument('--compare', help="Compare the results against a baseline saved earlier.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Slowdown against the baseline that counts as a regression. Defaults to 0.2.")
+    args = parser.parse_args()
+
+    n_machine.resources = synthetic_resources(args.seed, months=[(YEAR, MONTH)])
+    n_machine.decoding.use_backend(args.json_backend)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "out")
+        os.mkdir(output)
+        file, data = write_month(tmp, args.lines, args.seed, YEAR, MONTH)
+        print(f"{args.lines:,} lines, {len(data) / 1e6:.1f} MB decompressed, {os.path.getsize(file) / 1e6:.1f} MB compressed")
+        results = run_stages(file, data, output, args.repeat)
+
+    print(f"{'stage':<38}{'lines':>10}{'seconds':>10}{'lines/s':>14}{'MB/s':>10}")
+    for stage, (seconds, lines, size) in results.items():
+        print(f"{stage:<38}{lines:>10,}{seconds:>10.3f}{lines / seconds:>14,.0f}{size / seconds / 1e6:>10.1f}")
+
+    if args.save:
+        baseline = {'lines': args.lines, 'seed': args.seed, 'python': platform.python_version(), 'machine': platform.machine(),
+                    'backend': n_machine.decoding.active_backend,
+                    'stages': {stage: {'lines_per_s': lines / seconds, 'mb_per_s': size / seconds / 1e6}
+                               for stage, (seconds, lines, size) in results.items()}}
+        with open(args.save, 'w', encoding='utf-8') as outfile:
+            json.dump(baseline, outfile, indent=2)
+            outfile.write('\n')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as infile:
+            baseline = json.load(infile)
+        if baseline['lines'] != args.lines:
+            print(f"Warning: the baseline was taken with --lines {baseline['lines']}")
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
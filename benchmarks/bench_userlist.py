@@ -0,0 +1,70 @@
+'''
+Benchmark of the userlist backends: a Python set against the memory-mapped hash table of --userlist_backend hashed,
+with and without its Bloom filter.
+
+Pickles a synthetic userlist of --authors names, converts it as the userlist command does, and reports for each backend
+the memory it takes and the lookups per second of authors that are on the list and of authors that are not.
+The set's memory is what tracemalloc sees while unpickling it; the hash table's is the size of the mapped files,
+which all processes on the machine share. Lookups bypass the cache of recent verdicts, so that they measure the table itself.
+
+Usage:
+poetry run python benchmarks/bench_userlist.py [--authors N] [--lookups N]
+'''
+
+import os
+import time
+import pickle
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+from n_machine.userlist import HashedUserlist, convert_userlist
+
+
+def time_lookups(contains, names: list) -> float:
+    """Return the lookups per second of a membership test over names, which must all give the same verdict."""
+    start = time.perf_counter()
+    found = sum(1 for name in names if contains(name))
+    seconds = time.perf_counter() - start
+    assert found in (0, len(names))
+    return len(names) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the memory and lookup speed of the userlist backends")
+    parser.add_argument('--authors', type=int, default=1000000, help="Number of authors on the synthetic userlist.")
+    parser.add_argument('--lookups', type=int, default=500000, help="Number of lookups of listed and of unlisted authors each.")
+    parser.add_argument('--bits_per_author', type=int, default=10, help="Size of the Bloom filter in bits per author.")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    listed = [f"user{i}" for i in range(0, 2 * args.authors, 2)]
+    hits = [rng.choice(listed) for _ in range(args.lookups)]
+    misses = [f"user{2 * rng.randrange(args.authors) + 1}" for _ in range(args.lookups)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "userlist.pkl")
+        with open(path, "wb") as outfile:
+            pickle.dump(listed, outfile)
+
+        tracemalloc.start()
+        with open(path, "rb") as infile:
+            userlist = set(pickle.load(infile))
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        _, hashes_path, bloom_path = convert_userlist(path, args.bits_per_author)
+        print(f"{args.authors:,} authors, converted in {time.perf_counter() - start:.1f}s")
+        print(f"{'backend':<20}{'MiB':>10}{'hits/s':>14}{'misses/s':>14}")
+
+        print(f"{'set':<20}{memory / 2**20:>10.1f}{time_lookups(userlist.__contains__, hits):>14,.0f}{time_lookups(userlist.__contains__, misses):>14,.0f}")
+        for name, bloom in (("hashed", True), ("hashed, no Bloom", False)):
+            hashed = HashedUserlist(path, bloom=bloom)
+            size = os.path.getsize(hashes_path) + (os.path.getsize(bloom_path) if bloom else 0)
+            print(f"{name:<20}{size / 2**20:>10.1f}{time_lookups(hashed.lookup, hits):>14,.0f}{time_lookups(hashed.lookup, misses):>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+'''
+Synthetic Pushshift comment dumps for the benchmarks.
+
+Generates months of comments whose fields are distributed roughly like those of the real dumps:
+subreddits and authors follow heavy-tailed (Zipf-like) popularity, a share of the comments carries a user flair,
+a small share of those flairs declares pronouns, some authors are on the userlist, and a few comments are bot replies,
+deleted, or quote their parent. The matching comparison data (pronouns, userlist, K index, and the declarers' subreddits)
+is made up along with them, so that n_machine can be run over the synthetic months without any of the real files.
+
+Everything is drawn from a seeded random generator, so the same arguments always give the same data.
+'''
+
+import os
+import json
+import random
+import calendar
+import itertools
+from datetime import datetime
+
+from zstandard import ZstdCompressor
+
+from n_machine.resources import Resources
+
+
+PRONOUN_FLAIRS = ["she/her", "he/him", "they/them", "she/they", "he/they", "xe/xem", "They/Them", "she/her | mod"]
+OTHER_FLAIRS = ["Verified", "Moderator", "Top Contributor", "Berlin", "Team Red", "Lurker", "PhD", "he said what"]
+PRONOUNS = ['he', 'him', 'she', 'her', 'they', 'them', 'xe', 'xem', '']
+WORDS = ["the", "pronoun", "flair", "reddit", "comment", "thread", "because", "i", "think", "so",
+         "this", "is", "what", "you", "said", "about", "it", "and", "not", "really"]
+
+SHAPE = {
+    'subreddits': 5000, # distinct subreddits in a month
+    'authors': 100000, # distinct authors in a month
+    'skew': 1.1, # exponent of the Zipf-like popularity of subreddits and authors
+    'flair_rate': 0.15, # share of comments with a user flair
+    'pronoun_flair_rate': 0.05, # share of flairs that declare pronouns
+    'userlist_rate': 0.02, # share of authors that are on the userlist
+    'bot_rate': 0.005, # share of comments by bots
+    'deleted_rate': 0.03, # share of comments by deleted authors
+    'quote_rate': 0.1, # share of comments that quote their parent
+    'declarer_subs': 200, # subreddits the declarers posted in
+}
+
+
+def zipf_weights(n: int, skew: float) -> list:
+    """Return the cumulative weights of n ranks with Zipf-like popularity, for random.choices()."""
+    return list(itertools.accumulate(1 / rank**skew for rank in range(1, n + 1)))
+
+
+def synthetic_comments(n: int, seed: int = 0, year: int = 2021, month: int = 1, **shape):
+    """Iterate over n comments of a month as dicts shaped like Pushshift comments, in time order."""
+    shape = {**SHAPE, **shape}
+    rng = random.Random(seed)
+    start = calendar.timegm(datetime(year, month, 1).timetuple())
+    seconds = calendar.monthrange(year, month)[1] * 86400
+
+    subreddits = rng.choices(range(shape['subreddits']), cum_weights=zipf_weights(shape['subreddits'], shape['skew']), k=n)
+    authors = rng.choices(range(shape['authors']), cum_weights=zipf_weights(shape['authors'], shape['skew']), k=n)
+    times = sorted(start + rng.randrange(seconds) for _ in range(n))
+    # authors keep their flair over the month, as they do on Reddit
+    flairs = dict()
+
+    for i in range(n):
+        author = f"user{authors[i]}"
+        if rng.random() < shape['deleted_rate']:
+            author = "[deleted]"
+        if author not in flairs:
+            flair = None
+            if rng.random() < shape['flair_rate']:
+                flair = rng.choice(PRONOUN_FLAIRS if rng.random() < shape['pronoun_flair_rate'] else OTHER_FLAIRS)
+            flairs[author] = flair
+
+        body = " ".join(rng.choice(WORDS) for _ in range(max(1, int(rng.lognormvariate(2.5, 1)))))
+        if rng.random() < shape['quote_rate']:
+            body = "&gt;" + " ".join(rng.choice(WORDS) for _ in range(8)) + "\n\n" + body
+        if rng.random() < shape['bot_rate']:
+            body += "\n\n*I'm a bot, and this action was performed automatically.*"
+
+        subreddit = f"sub{subreddits[i]}"
+        link = f"k{i // 50:05x}"
+        comment_id = f"g{i:06x}"
+        yield {"author": author, "author_flair_text": flairs[author], "body": body, "created_utc": times[i],
+               "id": comment_id, "link_id": f"t3_{link}", "parent_id": f"t3_{link}" if i % 3 else f"t1_g{max(i - 1, 0):06x}",
+               "permalink": f"/r/{subreddit}/comments/{link}/_/{comment_id}/",
+               "score": int(rng.paretovariate(1.5)) - rng.randint(0, 2), "subreddit": subreddit}
+
+
+def synthetic_lines(n: int, seed: int = 0, **shape) -> bytes:
+    """Return n comments as the JSON lines of a decompressed dump."""
+    lines = [json.dumps(comment, separators=(',', ':')) for comment in synthetic_comments(n, seed, **shape)]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def write_month(directory: str, n: int, seed: int = 0, year: int = 2021, month: int = 1, **shape) -> tuple:
+    """Write a zstd-compressed month of n comments into a directory, returning its path and decompressed data."""
+    data = synthetic_lines(n, seed, year=year, month=month, **shape)
+    path = os.path.join(directory, f"RC_{year}-{month:02d}.zst")
+    with open(path, 'wb') as outfile:
+        outfile.write(ZstdCompressor(level=3).compress(data))
+    return path, data
+
+
+def synthetic_resources(seed: int = 0, months: list = ((2021, 1),), **shape) -> Resources:
+    """
+    Return resources with made-up comparison data that fits synthetic months of the same shape, without reading any files.
+    The declarers posted in popular and in rare subreddits alike, with a K between 1 and 20 in each of them.
+    """
+    shape = {**SHAPE, **shape}
+    rng = random.Random(seed)
+    subs = [f"sub{i}" for i in rng.sample(range(shape['subreddits']), shape['declarer_subs'])]
+    userlist = {f"user{i}" for i in range(shape['authors']) if rng.random() < shape['userlist_rate']}
+    k_index = {(year, month): {sub: rng.randint(1, 20) for sub in subs} for year, month in months}
+
+    resources = Resources()
+    resources.bundle = {'key': None, 'pronouns': PRONOUNS, 'userlist': userlist, 'k_index': k_index, 'subs': subs}
+    return resources
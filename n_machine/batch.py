@@ -0,0 +1,107 @@
+'''
+Vectorised filtering of blocks of comment lines.
+
+Instead of decoding and testing every line on its own, a whole block is decoded into columns, with pyarrow's JSON reader
+if pyarrow is installed and pandas otherwise, and the tests of relevant() run as vectorised operations on the columns.
+The flair regex and the userlist are only consulted once for each distinct flair and author in the block.
+The result is the same as that of rejection_reason(), line by line.
+'''
+
+import io
+
+import numpy as np
+import pandas as pd
+
+from n_machine.stats import REASONS
+
+try:
+    import pyarrow as pa
+    import pyarrow.json
+except ImportError:
+    pa = None
+
+
+COLUMNS = ['body', 'author', 'author_flair_text', 'subreddit', 'score']
+BOT_PHRASE = "i'm a bot"
+
+if pa is not None:
+    SCHEMA = pa.schema([('body', pa.string()), ('author', pa.string()), ('author_flair_text', pa.string()),
+                        ('subreddit', pa.string()), ('score', pa.int64())])
+    READ_OPTIONS = pa.json.ReadOptions(block_size=2**22)
+    PARSE_OPTIONS = pa.json.ParseOptions(explicit_schema=SCHEMA, unexpected_field_behavior='ignore')
+
+
+def read_columns(lines: list) -> pd.DataFrame:
+    """
+    Decode a block of JSON lines into a DataFrame of the columns relevant() looks at.
+    Raises a ValueError if the block can't be decoded into these columns, eg. because of unusual field types.
+    """
+    data = b'\n'.join(lines)
+    if pa is not None:
+        try:
+            table = pa.json.read_json(io.BytesIO(data), read_options=READ_OPTIONS, parse_options=PARSE_OPTIONS)
+        except pa.ArrowInvalid as e:
+            raise ValueError(str(e)) from e
+        frame = table.to_pandas(types_mapper=pd.ArrowDtype)
+    else:
+        frame = pd.read_json(io.BytesIO(data), lines=True, dtype=False, convert_dates=False)
+        if any(column not in frame for column in COLUMNS):
+            raise ValueError("The block lacks some of the columns relevant() looks at")
+        frame = frame[COLUMNS]
+    if len(frame) != len(lines):
+        raise ValueError(f"Decoded {len(frame)} rows from {len(lines)} lines")
+    return frame
+
+
+def is_bot(bodies: pd.Series) -> pd.Series:
+    """
+    Test which comment texts contain the bot phrase, in the same way as filter().
+    The vectorised lowercasing can differ from Python's for a few characters, but only ever by finding the phrase
+    where Python wouldn't, so its hits are confirmed with Python's lower().
+    """
+    candidates = bodies.str.lower().str.contains(BOT_PHRASE, regex=False).fillna(False).astype(bool)
+    bots = pd.Series(False, index=bodies.index)
+    for i in candidates[candidates].index:
+        bots[i] = BOT_PHRASE in bodies[i].lower()
+    return bots
+
+
+def rejection_reasons(lines: list, filters: list, popularity, dont_filter: bool, matcher, userlist) -> list:
+    """
+    Return, for each line of a block, the rejection reason of each filter, as rejection_reason() would give it,
+    ie. a tuple with one of stats.REASONS or None per filter. The filters are (subs, baseline_nr) pairs as passed to relevant().
+    Raises a ValueError if the block can't be decoded into columns, in which case it has to be filtered line by line.
+    """
+    frame = read_columns(lines)
+    false = pd.Series(False, index=frame.index)
+
+    low_score = false
+    bot = false
+    if not dont_filter:
+        if popularity is not None:
+            low_score = ~(frame['score'] >= popularity).fillna(False).astype(bool)
+        bot = is_bot(frame['body'])
+
+    flairs = frame['author_flair_text'].dropna().unique().tolist()
+    declaring = [flair for flair in flairs if matcher.declares(flair)]
+    flair = frame['author_flair_text'].isin(declaring).fillna(False).astype(bool) if declaring else false
+
+    listed = [author for author in frame['author'].dropna().unique().tolist() if author in userlist]
+    on_userlist = frame['author'].isin(listed).fillna(False).astype(bool) if listed else false
+
+    # the first test each line fails for each filter, in the order of rejection_reason(), as an index into REASONS + [None]
+    # the search options are only tested line by line
+    tests = [low_score.to_numpy(), bot.to_numpy(), flair.to_numpy(), on_userlist.to_numpy()]
+    choices = [REASONS.index(reason) for reason in ('subreddit', 'score', 'bot', 'flair', 'userlist')]
+    codes = np.zeros(len(frame), dtype=np.int64)
+    for nr, (subs, baseline_nr) in enumerate(filters):
+        in_subs = frame['subreddit'].isin(subs).fillna(False).astype(bool).to_numpy()
+        wrong_subreddit = ~in_subs if baseline_nr == 1 else in_subs
+        reason = np.select([wrong_subreddit] + tests, choices, default=len(REASONS))
+        codes += reason * (len(REASONS) + 1) ** nr
+
+    # map the codes back to tuples of reasons, once for each distinct combination
+    reasons = REASONS + [None]
+    combinations = {code: tuple(reasons[code // len(reasons) ** nr % len(reasons)] for nr in range(len(filters)))
+                    for code in np.unique(codes).tolist()}
+    return [combinations[code] for code in codes.tolist()]
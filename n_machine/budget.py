@@ -0,0 +1,72 @@
+'''
+Budgets for an optional bounded scan of a month.
+
+By default a month is read to its end, so that every reservoir is an exact uniform sample of all its comments.
+A bounded scan instead stops reading once every reservoir has seen at least c times as many relevant comments as it keeps,
+and at least a minimum fraction of the dump has been read.
+
+The trade-off: each reservoir is then still a uniform sample, but of the comments in the part of the month that was read
+rather than of the whole month. Since the dumps are ordered by time, comments from the end of the month
+are underrepresented, and more so for subreddits whose activity changes over the month.
+With c well above 1 and a generous minimum fraction, every sampled comment was drawn from a pool of at least c*K comments
+spread over at least that fraction of the month. The budget report records, per subreddit, which fraction of the dump
+had been read by the time its reservoir reached c*K comments, so the approximation can be checked afterwards.
+'''
+
+import json
+
+
+class ScanBudget:
+    """
+    Track the reservoirs of a month's baselines against a bounded scan.
+    Fractions are positions in the (compressed) dump file, which is what progress is reported in.
+    """
+
+    def __init__(self, c: float, min_fraction: float, file_size: int):
+        self.c = c
+        self.min_fraction = min_fraction
+        self.file_size = file_size
+        self.fraction = 0.0
+        self.stopped_early = False
+        self.reservoirs = dict() # (sink name, subreddit) -> reservoir
+        self.reached = dict() # (sink name, subreddit) -> fraction read when the reservoir reached c*K comments
+
+    def track(self, name: str, reservoirs: dict):
+        """Track the reservoirs of a sink, skipping those without a target."""
+        for key, reservoir in reservoirs.items():
+            if reservoir.k > 0:
+                self.reservoirs[(name, key)] = reservoir
+
+    def update(self, compressed_offset: int) -> bool:
+        """Note how far the dump has been read, and return whether the scan can stop there."""
+        self.fraction = min(compressed_offset / self.file_size, 1.0) if self.file_size else 1.0
+        for key, reservoir in self.reservoirs.items():
+            if key not in self.reached and reservoir.n >= self.c * reservoir.k:
+                self.reached[key] = self.fraction
+        self.stopped_early = self.fraction >= self.min_fraction and len(self.reached) == len(self.reservoirs)
+        return self.stopped_early
+
+    def finish(self):
+        """Note that the dump was read to its end."""
+        if not self.stopped_early:
+            self.fraction = 1.0
+
+    def state(self) -> dict:
+        return self.reached
+
+    def restore(self, state: dict):
+        self.reached = state
+
+    def report(self, name: str) -> dict:
+        """Return how much of the month was read for each subreddit of a sink."""
+        subreddits = dict()
+        for (sink, key), reservoir in self.reservoirs.items():
+            if sink == name:
+                subreddits[key if key is not None else 'all'] = {
+                    'k': reservoir.k, 'seen': reservoir.n, 'fraction_read_at_target': self.reached.get((sink, key))}
+        return {'c': self.c, 'min_fraction': self.min_fraction, 'fraction_read': self.fraction,
+                'stopped_early': self.stopped_early, 'subreddits': subreddits}
+
+    def write_report(self, name: str, path: str):
+        with open(path, "w", encoding="utf-8") as outfile:
+            json.dump(self.report(name), outfile, indent=2)
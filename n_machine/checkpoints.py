@@ -0,0 +1,111 @@
+'''
+Checkpoints for resuming interrupted runs.
+
+A manifest in the output directory records which months are finished, and with which parameters.
+While a month is processed, its sampling state is snapshotted periodically together with the position
+in the data dump, so that a restarted run can pick the month up where it left off.
+'''
+
+import os
+import json
+import time
+import pickle
+import hashlib
+import argparse
+from datetime import datetime
+
+from n_machine.files import write_atomically
+
+
+MANIFEST_NAME = "n_machine_manifest.json"
+CHECKPOINT_DIR = ".n_machine_checkpoints"
+
+# options that only affect how a run is executed, not its results
+RUN_OPTIONS = {'input', 'output', 'time_from', 'time_to', 'reverse_order', 'workers', 'decode_workers', 'block_size',
+               'batch_size', 'chunk_size', 'json_backend', 'decompress_threads', 'prefetch', 'cache_dir', 'no_cache', 'userlist_backend', 'no_index', 'reservoir_memory_mb', 'progress_interval', 'checkpoint_interval',
+               'restart', 'count_store'}
+
+
+def run_parameters(args: argparse.Namespace) -> dict:
+    """Return the parameters that determine the results of a run."""
+    return {key: value for key, value in sorted(vars(args).items()) if key not in RUN_OPTIONS}
+
+
+def fingerprint(params: dict) -> str:
+    """Return a short hash of a set of parameters."""
+    parameters = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(parameters.encode()).hexdigest()[:16]
+
+
+def run_fingerprint(args: argparse.Namespace) -> str:
+    """Return a short hash of the parameters that determine the results of a run."""
+    return fingerprint(run_parameters(args))
+
+
+def load_manifest(output_dir: str) -> dict:
+    """Load the manifest of finished months in an output directory."""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return dict()
+    with open(path, encoding="utf-8") as infile:
+        return json.load(infile)
+
+
+def finished_months(output_dir: str, args: argparse.Namespace) -> dict:
+    """Return the months already finished with the same parameters, mapped to their output files by sink, if those all still exist."""
+    runs = load_manifest(output_dir).get(run_fingerprint(args), {})
+    return {month: entry['outfiles'] for month, entry in runs.get('months', {}).items()
+            if all(os.path.isfile(outfile) for outfile in entry['outfiles'].values())}
+
+
+def record_month(output_dir: str, args: argparse.Namespace, month: str, outfiles: dict):
+    """
+    Record a finished month in the manifest.
+    Only the main process writes the manifest, so there are no concurrent updates.
+    """
+    manifest = load_manifest(output_dir)
+    run = manifest.setdefault(run_fingerprint(args), {'parameters': run_parameters(args), 'months': {}})
+    run['months'][month] = {'outfiles': outfiles, 'finished_at': datetime.now().isoformat(timespec='seconds')}
+    data = json.dumps(manifest, indent=2, default=str)
+    with write_atomically(os.path.join(output_dir, MANIFEST_NAME)) as outfile:
+        outfile.write(data.encode())
+
+
+class MonthCheckpoint:
+    """
+    Periodic snapshots of the sampling state of one month.
+    A snapshot holds everything needed to continue the month as if it had never been interrupted:
+    the reservoirs and counts including their random generators, the output file names, and the offsets in the dump
+    right after the last line whose comment went into the reservoirs.
+    """
+
+    def __init__(self, output_dir: str, args: argparse.Namespace, month: str):
+        self.fingerprint = run_fingerprint(args)
+        self.path = os.path.join(output_dir, CHECKPOINT_DIR, f"{self.fingerprint}_{month}.pkl")
+        self.interval = args.checkpoint_interval
+        self.last_save = time.monotonic()
+
+    def load(self):
+        """Return the latest snapshot of the month, or None if there is none to resume from."""
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, "rb") as infile:
+            snapshot = pickle.load(infile)
+        return snapshot if snapshot['fingerprint'] == self.fingerprint else None
+
+    def due(self) -> bool:
+        """Test if it's time for the next snapshot."""
+        return self.interval > 0 and time.monotonic() - self.last_save >= self.interval
+
+    def save(self, snapshot: dict):
+        """Save a snapshot, replacing the previous one."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        snapshot['fingerprint'] = self.fingerprint
+        with write_atomically(self.path) as outfile:
+            pickle.dump(snapshot, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        self.last_save = time.monotonic()
+
+    def remove(self):
+        """Remove the snapshots of a finished month."""
+        if os.path.isfile(self.path):
+            os.remove(self.path)
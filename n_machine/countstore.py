@@ -0,0 +1,113 @@
+'''
+A persistent store of the --count results.
+
+Counts are kept in an SQLite database, keyed by month, subreddit, and a hash of the parameters that determine them,
+together with the rejection reasons of the month's comments. Each month is written in a single transaction once it is finished,
+so the store only ever holds whole months, and later runs with the same parameters skip the months that are already in it.
+Questions across months, like the top subreddits of a timeframe or a subreddit's counts over time, are answered from the store
+without reading the dumps again, with the counts command of main.py.
+'''
+
+import json
+import sqlite3
+import argparse
+from datetime import datetime
+
+from n_machine.checkpoints import fingerprint, run_parameters
+
+
+COUNT_STORE_NAME = "n_machine_counts.sqlite"
+# months are stored as YYYY-MM, so that they sort and compare in time order
+FIRST_MONTH, LAST_MONTH = "0000-00", "9999-99"
+
+# parameters that only affect the sampled baselines and their output, not the counts
+SAMPLING_OPTIONS = {'baseline_nr', 'return_all', 'output_format', 'bounded_scan', 'min_fraction', 'count'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parameters (params TEXT PRIMARY KEY, json TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS months (month TEXT, params TEXT, lines INTEGER, finished_at TEXT, PRIMARY KEY (month, params));
+CREATE TABLE IF NOT EXISTS counts (month TEXT, subreddit TEXT, params TEXT, comments INTEGER, PRIMARY KEY (month, subreddit, params));
+CREATE TABLE IF NOT EXISTS rejections (month TEXT, params TEXT, reason TEXT, comments INTEGER, PRIMARY KEY (month, params, reason));
+"""
+
+
+def count_parameters(args: argparse.Namespace) -> dict:
+    """Return the parameters that determine the counts of a run."""
+    return {key: value for key, value in run_parameters(args).items() if key not in SAMPLING_OPTIONS}
+
+
+def count_fingerprint(args: argparse.Namespace) -> str:
+    """Return a short hash of the parameters that determine the counts of a run."""
+    return fingerprint(count_parameters(args))
+
+
+class CountStore:
+    """The counts of all months and parameter sets counted into one SQLite file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        # months processed in parallel write to the same store, so writers wait for each other's transactions
+        self.connection = sqlite3.connect(path, timeout=600)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add_month(self, month: str, args: argparse.Namespace, counts: dict, rejections: dict, lines: int):
+        """Store the counts and rejection reasons of a finished month, replacing any stored earlier with the same parameters."""
+        params = count_fingerprint(args)
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO parameters VALUES (?, ?)",
+                                    (params, json.dumps(count_parameters(args), sort_keys=True, default=str)))
+            for table in ('months', 'counts', 'rejections'):
+                self.connection.execute(f"DELETE FROM {table} WHERE month = ? AND params = ?", (month, params))
+            self.connection.executemany("INSERT INTO counts VALUES (?, ?, ?, ?)",
+                                        [(month, subreddit, params, n) for subreddit, n in counts.items()])
+            self.connection.executemany("INSERT INTO rejections VALUES (?, ?, ?, ?)",
+                                        [(month, params, reason, n) for reason, n in rejections.items()])
+            self.connection.execute("INSERT INTO months VALUES (?, ?, ?, ?)",
+                                    (month, params, lines, datetime.now().isoformat(timespec='seconds')))
+
+    def stored_months(self, args: argparse.Namespace) -> set:
+        """Return the months already counted with the same parameters."""
+        rows = self.connection.execute("SELECT month FROM months WHERE params = ?", (count_fingerprint(args),))
+        return {month for month, in rows}
+
+    def runs(self) -> list:
+        """Return every parameter set in the store with its parameters, number of months, and first and last month."""
+        rows = self.connection.execute("""SELECT parameters.params, json, COUNT(month), MIN(month), MAX(month) FROM parameters
+                                          LEFT JOIN months ON months.params = parameters.params GROUP BY parameters.params""")
+        return [{'params': params, 'parameters': json.loads(parameters), 'months': n, 'first': first, 'last': last}
+                for params, parameters, n, first, last in rows]
+
+    def resolve(self, prefix: str = None) -> str:
+        """Return the parameter hash starting with a prefix, or the only one in the store if none is given."""
+        matches = [run['params'] for run in self.runs() if prefix is None or run['params'].startswith(prefix)]
+        if len(matches) != 1:
+            raise ValueError(f"{len(matches)} parameter sets in {self.path} match {prefix or 'any'}, pick one with --params")
+        return matches[0]
+
+    def top(self, params: str, n: int, month_from: str = None, month_to: str = None) -> list:
+        """Return the subreddits with the most relevant comments in a timeframe, with their totals."""
+        rows = self.connection.execute("""SELECT subreddit, SUM(comments) AS total FROM counts WHERE params = ? AND month >= ? AND month <= ?
+                                          GROUP BY subreddit ORDER BY total DESC, subreddit LIMIT ?""",
+                                       (params, month_from or FIRST_MONTH, month_to or LAST_MONTH, n))
+        return rows.fetchall()
+
+    def trend(self, params: str, subreddits: list, month_from: str = None, month_to: str = None) -> list:
+        """Return the counts of the given subreddits, or the totals over all subreddits if none are given, month by month."""
+        bounds = (params, month_from or FIRST_MONTH, month_to or LAST_MONTH)
+        if not subreddits:
+            rows = self.connection.execute("""SELECT month, 'all', SUM(comments) FROM counts WHERE params = ? AND month >= ? AND month <= ?
+                                              GROUP BY month ORDER BY month""", bounds)
+        else:
+            placeholders = ", ".join("?" for _ in subreddits)
+            rows = self.connection.execute(f"""SELECT month, subreddit, comments FROM counts WHERE params = ? AND month >= ? AND month <= ?
+                                               AND subreddit IN ({placeholders}) ORDER BY month, subreddit""", bounds + tuple(subreddits))
+        return rows.fetchall()
+
+    def rejections(self, params: str, month_from: str = None, month_to: str = None) -> list:
+        """Return the number of comments rejected for each reason, and the relevant ones, month by month."""
+        rows = self.connection.execute("""SELECT month, reason, comments FROM rejections WHERE params = ? AND month >= ? AND month <= ?
+                                          ORDER BY month, reason""", (params, month_from or FIRST_MONTH, month_to or LAST_MONTH))
+        return rows.fetchall()
@@ -0,0 +1,138 @@
+'''
+Decoding of the Pushshift JSON lines.
+
+Uses msgspec or orjson if either is installed, and falls back to the standard library's json module otherwise.
+Comments are decoded into Comment objects that only hold the fields relevant() and extract() read,
+which keeps reservoirs of thousands of comments per subreddit much smaller than full dicts.
+Full dicts are still available through loads(), eg. for --return_all.
+'''
+
+import re
+import json
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+BACKENDS = ['msgspec', 'orjson', 'json']
+
+# string fields as they appear in the raw JSON of a comment, for looking them up without decoding the line
+# values with escape sequences don't match, which sends the line on to full decoding
+subreddit_field = re.compile(rb'"subreddit":\s*"([^"\\]*)"')
+author_field = re.compile(rb'"author":\s*"([^"\\]*)"')
+parent_field = re.compile(rb'"parent_id":\s*"([^"\\]*)"')
+
+COMMENT_FIELDS = ('body', 'author', 'author_flair_text', 'subreddit', 'score', 'created_utc', 'link_id', 'id', 'permalink', 'parent_id')
+
+
+if msgspec is not None:
+    class Comment(msgspec.Struct, gc=False):
+        """The fields of a Reddit comment that are used for filtering and extraction."""
+        body: str
+        author: str
+        author_flair_text: str | None
+        subreddit: str
+        score: int
+        created_utc: int | str
+        link_id: str
+        id: str
+        permalink: str | None = None
+        parent_id: str | None = None
+
+        def __getitem__(self, key):
+            return getattr(self, key)
+
+        def get(self, key, default=None):
+            return getattr(self, key, default)
+
+else:
+    class Comment:
+        """The fields of a Reddit comment that are used for filtering and extraction."""
+        __slots__ = COMMENT_FIELDS
+
+        def __init__(self, body, author, author_flair_text, subreddit, score, created_utc, link_id, id, permalink=None, parent_id=None):
+            self.body = body
+            self.author = author
+            self.author_flair_text = author_flair_text
+            self.subreddit = subreddit
+            self.score = score
+            self.created_utc = created_utc
+            self.link_id = link_id
+            self.id = id
+            self.permalink = permalink
+            self.parent_id = parent_id
+
+        def __getitem__(self, key):
+            return getattr(self, key)
+
+        def get(self, key, default=None):
+            return getattr(self, key, default)
+
+
+def comment_from_dict(comment: dict) -> Comment:
+    """Keep only the used fields of a fully decoded comment."""
+    return Comment(comment['body'], comment['author'], comment.get('author_flair_text'), comment['subreddit'],
+                   comment['score'], comment['created_utc'], comment['link_id'], comment['id'], comment.get('permalink'),
+                   comment.get('parent_id'))
+
+
+def encode_comment(comment) -> bytes:
+    """Encode a Comment or a fully decoded comment back into a JSON line, which every backend decodes the same again."""
+    if msgspec is not None:
+        return msgspec.json.encode(comment)
+    if not isinstance(comment, dict):
+        comment = {field: getattr(comment, field) for field in COMMENT_FIELDS}
+    return orjson.dumps(comment) if orjson is not None else json.dumps(comment).encode()
+
+
+def backend_functions(backend: str) -> tuple:
+    """Return the functions decoding a line into a dict and into a Comment for one of the BACKENDS."""
+    if backend == 'msgspec':
+        if msgspec is None:
+            raise ImportError("The msgspec JSON backend was requested but msgspec is not installed.")
+        decoder = msgspec.json.Decoder(Comment)
+
+        def decode_comment(line) -> Comment:
+            try:
+                return decoder.decode(line)
+            except msgspec.ValidationError:
+                # unusual field types in some of the older dumps, eg. a float score
+                return comment_from_dict(msgspec.json.decode(line))
+
+        return msgspec.json.decode, decode_comment
+
+    if backend == 'orjson':
+        if orjson is None:
+            raise ImportError("The orjson JSON backend was requested but orjson is not installed.")
+        loads = orjson.loads
+    elif backend == 'json':
+        loads = json.loads
+    else:
+        raise ValueError(f"Unknown JSON backend: {backend}")
+
+    def decode_comment(line) -> Comment:
+        return comment_from_dict(loads(line))
+
+    return loads, decode_comment
+
+
+def use_backend(backend: str = 'auto'):
+    """
+    Bind loads() and decode_comment() to a JSON backend.
+    'auto' picks the fastest installed one.
+    """
+    global loads, decode_comment, active_backend
+    if backend == 'auto':
+        backend = 'msgspec' if msgspec is not None else 'orjson' if orjson is not None else 'json'
+    loads, decode_comment = backend_functions(backend)
+    active_backend = backend
+
+
+use_backend()
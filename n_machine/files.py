@@ -0,0 +1,28 @@
+'''
+Writing files that other processes, or later runs, read.
+
+The manifest, checkpoints, caches, and indexes n_machine keeps next to its inputs and outputs are all written
+through a temporary file that replaces the file once it is complete, so they are never read half-written.
+'''
+
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def write_atomically(path: str):
+    """
+    Open a file for writing in binary mode through a temporary file, which replaces it once everything is written,
+    so that neither a crash nor other processes reading it ever see it half-written.
+    The temporary file is named after the process, since several processes may write the same file at once.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as outfile:
+            yield outfile
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
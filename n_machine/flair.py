@@ -0,0 +1,89 @@
+'''
+Matching of pronoun declarations in user flairs.
+
+Comments by users whose flair declares pronouns are excluded from the baselines.
+'''
+
+import re
+import time
+from functools import lru_cache
+
+
+# eg. "her/herself" or "fae/faeself", for pronouns missing from the lists
+free_pronoun_regex = '(.+)/\\2s(elf)?\\b'
+
+noanyall_regex = "(no|any|all).pronouns?"
+
+FLAIR_CACHE_SIZE = 2**16
+
+
+def trie_regex(words) -> str:
+    """
+    Return a regex matching exactly the given words, with common prefixes factored out.
+    Unlike a plain alternation of thousands of words, the regex engine then only follows the branch
+    that fits the text it is looking at instead of trying every word in turn.
+    """
+    trie = dict()
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, dict())
+        node[''] = dict() # marks the end of a word
+
+    def pattern(node) -> str:
+        branches = [re.escape(char) + pattern(child) for char, child in sorted(node.items()) if char != '']
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')' + ('?' if '' in node else '')
+
+    return pattern(trie)
+
+
+def negative_regex(pronouns) -> str:
+    """Return the regex for flairs that declare pronouns, either from the pronoun lists or in free form."""
+    pronouns_regex = f'(?:{trie_regex(pronouns)})'
+    pronouns_regex = f'\\b{pronouns_regex}/{pronouns_regex}\\b'
+    combined_regexes = '|'.join([pronouns_regex, free_pronoun_regex, noanyall_regex])
+    return f'(?:({combined_regexes}))'
+
+
+class FlairMatcher:
+    """
+    Test user flairs for pronoun declarations.
+    The regex is compiled once, and verdicts are kept in a bounded LRU cache since the same flairs
+    come up over and over again across comments.
+    """
+
+    def __init__(self, pronouns, case_sensitive: bool, cache_size: int = FLAIR_CACHE_SIZE):
+        self.regex = re.compile(negative_regex(pronouns), 0 if case_sensitive else re.IGNORECASE)
+        self.match_seconds = 0.0
+        self.declares = lru_cache(maxsize=cache_size)(self.search)
+
+    def search(self, flair: str) -> bool:
+        """Test a flair against the regex, bypassing the cache."""
+        start = time.perf_counter()
+        found = self.regex.search(flair) is not None
+        self.match_seconds += time.perf_counter() - start
+        return found
+
+    def stats(self, since: dict = None) -> dict:
+        """Return the cache hits and misses and the time spent matching so far, or since an earlier snapshot."""
+        info = self.declares.cache_info()
+        stats = {'cache_hits': info.hits, 'cache_misses': info.misses, 'match_seconds': self.match_seconds}
+        if since is not None:
+            stats = {key: value - since[key] for key, value in stats.items()}
+        return stats
+
+
+def add_stats(a: dict, b: dict) -> dict:
+    """Add up the matcher stats of two processes."""
+    return {key: a.get(key, 0) + value for key, value in b.items()}
+
+
+def describe_stats(stats: dict) -> str:
+    """Summarize matcher stats for the log."""
+    lookups = stats['cache_hits'] + stats['cache_misses']
+    hit_rate = stats['cache_hits'] / lookups if lookups else 0.0
+    return f"{lookups:,} flairs looked up, {hit_rate:.1%} cache hits, {stats['match_seconds']:.1f}s spent matching"
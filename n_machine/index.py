@@ -0,0 +1,204 @@
+'''
+Subreddit indexes over the monthly data dumps.
+
+Indexing scans a dump once and splits it into frames of whole lines. For every frame, the index records where it lies
+in the file and in the decompressed stream, how many lines it has, and how many comments each subreddit has in it,
+along with the subreddits' totals for the month. The index is kept in a sidecar file next to the dump.
+
+Optionally, the dump is re-encoded in the seekable zstd format on the way: every frame becomes an independent zstd frame,
+followed by a seek table in a skippable frame. Plain zstd readers still read such a file as usual.
+Runs over an indexed seekable or uncompressed dump then only read and decompress the frames
+that hold comments of the subreddits they are looking for.
+'''
+
+import os
+import pickle
+import struct
+import logging
+
+from zstandard import ZstdCompressor, ZstdDecompressor
+
+from n_machine import decoding
+from n_machine.files import write_atomically
+from n_machine.readers import file_ending, open_lines
+
+
+INDEX_VERSION = 1
+INDEX_ENDING = ".index.pkl"
+DEFAULT_FRAME_SIZE = 2**23 # 8 MiB of decompressed lines per frame
+
+# the seekable zstd format, as specified in zstd's contrib/seekable_format
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+
+
+def index_path(dump: str) -> str:
+    """Return the path of the sidecar index of a dump."""
+    return dump + INDEX_ENDING
+
+
+def subreddit_of(line: bytes) -> str:
+    """Return the subreddit of a raw comment line, decoding the line only if the field can't be read off directly."""
+    match = decoding.subreddit_field.search(line)
+    if match is not None:
+        return match.group(1).decode()
+    return decoding.loads(line).get('subreddit')
+
+
+def seek_table(frames: list) -> bytes:
+    """Return the seek table of a seekable zstd file as a skippable frame, without checksums."""
+    entries = b''.join(struct.pack('<II', compressed_size, decompressed_size)
+                       for _, compressed_size, _, decompressed_size, _ in frames)
+    footer = struct.pack('<IBI', len(frames), 0, SEEKABLE_MAGIC)
+    return struct.pack('<II', SKIPPABLE_MAGIC, len(entries) + len(footer)) + entries + footer
+
+
+class IndexBuilder:
+    """
+    Collect the frames of a dump and the subreddits in each, re-encoding the frames into a seekable zstd file if one is given.
+    Frames are tuples of (compressed offset, compressed size, decompressed offset, decompressed size, line count).
+    The compressed offset and size are None for frames that can't be seeked to, ie. those of a compressed dump that is not re-encoded.
+    """
+
+    def __init__(self, seekable_file=None, plain: bool = False, level: int = 3, threads: int = 0):
+        self.seekable_file = seekable_file
+        self.plain = plain
+        self.compressor = ZstdCompressor(level=level, threads=threads) if seekable_file is not None else None
+        self.frames = []
+        self.subreddits = dict()
+        self.totals = dict()
+        # positions in the re-encoded dump
+        self.compressed_offset = 0
+        self.decompressed_offset = 0
+
+    def add_frame(self, lines: list, start: int, end: int):
+        """Add the lines between two decompressed offsets of the source dump as the next frame."""
+        frame_nr = len(self.frames)
+        counts = dict()
+        for line in lines:
+            subreddit = subreddit_of(line)
+            counts[subreddit] = counts.get(subreddit, 0) + 1
+        for subreddit, count in counts.items():
+            self.subreddits.setdefault(subreddit, []).append((frame_nr, count))
+            self.totals[subreddit] = self.totals.get(subreddit, 0) + count
+
+        if self.seekable_file is not None:
+            data = b'\n'.join(lines) + b'\n'
+            compressed = self.compressor.compress(data)
+            self.seekable_file.write(compressed)
+            self.frames.append((self.compressed_offset, len(compressed), self.decompressed_offset, len(data), len(lines)))
+            self.compressed_offset += len(compressed)
+            self.decompressed_offset += len(data)
+        elif self.plain:
+            self.frames.append((start, end - start, start, end - start, len(lines)))
+        else:
+            self.frames.append((None, None, start, end - start, len(lines)))
+
+    def finish(self):
+        if self.seekable_file is not None:
+            self.seekable_file.write(seek_table(self.frames))
+
+
+def build_index(dump: str, frame_size: int = DEFAULT_FRAME_SIZE, seekable_dump: str = None, level: int = 3, threads: int = 0) -> dict:
+    """
+    Index a dump, re-encoding it into a seekable zstd file at seekable_dump if that is given.
+    The index then describes the re-encoded file. Return the index.
+    """
+    plain = seekable_dump is None and file_ending(dump) == ''
+    seekable_file = open(seekable_dump, 'wb') if seekable_dump is not None else None
+    try:
+        builder = IndexBuilder(seekable_file, plain, level, threads)
+        with open_lines(dump) as lines:
+            frame, start, size = [], 0, 0
+            for line in lines:
+                frame.append(line)
+                size += len(line) + 1
+                if size >= frame_size:
+                    builder.add_frame(frame, start, lines.decompressed_offset)
+                    frame, start, size = [], lines.decompressed_offset, 0
+            if frame:
+                builder.add_frame(frame, start, lines.decompressed_offset)
+        builder.finish()
+    finally:
+        if seekable_file is not None:
+            seekable_file.close()
+
+    indexed = dump if seekable_dump is None else seekable_dump
+    stat = os.stat(indexed)
+    return {'version': INDEX_VERSION, 'dump': os.path.basename(indexed), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'seekable': seekable_dump is not None or plain, 'compressed': seekable_dump is not None,
+            'frames': builder.frames, 'subreddits': builder.subreddits, 'totals': builder.totals}
+
+
+def save_index(index: dict, path: str):
+    """Save an index, so that runs never read a half-written one."""
+    with write_atomically(path) as outfile:
+        pickle.dump(index, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_index(dump: str):
+    """Return the index of a dump, or None if there is none or it is out of date."""
+    path = index_path(dump)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as infile:
+        index = pickle.load(infile)
+    stat = os.stat(dump)
+    if index.get('version') != INDEX_VERSION or (index['size'], index['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+        logging.warning(f"Ignoring the index of {dump}, it is out of date")
+        return None
+    return index
+
+
+def wanted_frames(index: dict, filters: list) -> list:
+    """
+    Return the numbers of the frames that hold comments any of the filters may keep.
+    The filters are (subs, baseline_nr) pairs as passed to relevant(): baseline 1 wants comments in the subs, baseline 2 all others.
+    """
+    frame_subs = [set() for _ in index['frames']]
+    for subreddit, frames in index['subreddits'].items():
+        for frame_nr, _ in frames:
+            frame_subs[frame_nr].add(subreddit)
+
+    filters = [(set(subs), baseline_nr == 1) for subs, baseline_nr in filters]
+    wanted = list()
+    for frame_nr, subs_in_frame in enumerate(frame_subs):
+        for subs, in_subs in filters:
+            if (subs_in_frame & subs) if in_subs else (subs_in_frame - subs):
+                wanted.append(frame_nr)
+                break
+    return wanted
+
+
+class FrameReader:
+    """
+    Iterate over the lines of the given frames of an indexed dump, with the same interface as readers.LineReader.
+    Each frame is read and decompressed on its own, everything in between is skipped.
+    Reading can start at a decompressed offset reported earlier, even one in the middle of a frame.
+    """
+
+    def __init__(self, file_handle, index: dict, frame_nrs: list, start_offset: int = 0):
+        self.file_handle = file_handle
+        self.compressed = index['compressed']
+        self.frames = [index['frames'][frame_nr] for frame_nr in frame_nrs]
+        self.start_offset = start_offset
+        self.decompressed_offset = start_offset
+        self.compressed_offset = 0
+
+    def __iter__(self):
+        decompressor = ZstdDecompressor(max_window_size=2**31)
+        for compressed_offset, compressed_size, decompressed_offset, decompressed_size, _ in self.frames:
+            if decompressed_offset + decompressed_size <= self.start_offset:
+                continue
+            self.file_handle.seek(compressed_offset)
+            data = self.file_handle.read(compressed_size)
+            if self.compressed:
+                data = decompressor.decompress(data)
+            skip = max(self.start_offset - decompressed_offset, 0)
+            self.decompressed_offset = decompressed_offset + skip
+            self.compressed_offset = compressed_offset + compressed_size
+            for line in data[skip:].split(b'\n'):
+                self.decompressed_offset += len(line) + 1
+                if line:
+                    yield line
+            self.decompressed_offset = decompressed_offset + decompressed_size
@@ -9,107 +9,119 @@ Required args:
 --input or -I: path to directory containing the Pushshift data dumps
 --output or -O: desired output path
 --baseline_nr: 1 or 2, to set the extraction to be either "same community as declarers without pronoun declarations" or "random communities
+    Several baselines (and --count) can be given at once, eg. --baseline_nr 1 2 --count, to get them all from a single pass over the data.
 
 Optional args mostly from the otacon project.
 
+Indexing:
+poetry run python path/to/n_machine/n_machine/main.py index --input path/to/dumps [--output path/to/seekable/dumps]
+Counts the comments per subreddit in every frame of each dump, and re-encodes the dumps as seekable zstd if an output path is given.
+Later runs over seekable or uncompressed dumps with an index only read the frames with comments they may need.
+
+Converting the userlist:
+poetry run python path/to/n_machine/n_machine/main.py userlist [--userlist path/to/userlist.pkl]
+Converts the userlist into a memory-mapped hash table with a Bloom filter next to it, which runs use with --userlist_backend hashed.
+
+Querying the counts:
+poetry run python path/to/n_machine/n_machine/main.py counts --store path/to/n_machine_counts.sqlite {runs,top,trend,rejections}
+Runs with --count and an output directory store their counts in n_machine_counts.sqlite there, and skip the months already stored.
+The counts command answers questions across months from the store, without reading the dumps.
+
 
 '''
 
 import os
 import re
-import csv
+import sys
 import json
-import pickle
-import random
+import math
+import bisect
+import time
 import logging
 import calendar
 import argparse
+import itertools
+from collections import Counter, deque
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
-from typing import TextIO
-import pandas as pd
-import langdetect
-from langdetect import detect
-
-from zstandard import ZstdDecompressor
-
-# keep track of already-processed comments throughout function calls
-hash_list = []
-
-# return stats from which subreddits the relevant comments were and how many per subreddits
-stats_dict = {}
-
-pronouns_path = os.path.expanduser("~/Documents/GitHub/pronounlist/Pronouns")
-pronouns = list()
-for root, dirs, files in os.walk(pronouns_path):
-	for file in files:
-		if not file.startswith('.'):
-			filepath = os.path.join(root, file)
-			with open(filepath) as infile:
-				prons = infile.read().split('\n')
-				for elem in prons:
-					pronouns.append(elem)
-
-with open(os.path.expanduser("~/Documents/GitHub/n_machine/assets/userlist.pkl"), "rb") as infile:
-    userlist = set(pickle.load(infile))
-
-# dedupe
-pronouns = list(set(pronouns))
-# sort by length to ensure correct matching
-pronouns = sorted(pronouns, key=lambda x: len(x), reverse=True)
 
+from n_machine import decoding
+from n_machine.flair import add_stats, describe_stats
+from n_machine.budget import ScanBudget
+from n_machine.checkpoints import MonthCheckpoint, finished_months, record_month
+from n_machine.countstore import COUNT_STORE_NAME, CountStore
+from n_machine.index import DEFAULT_FRAME_SIZE, FrameReader, build_index, index_path, load_index, save_index, wanted_frames
+from n_machine.readers import CODECS, DEFAULT_CHUNK_SIZE, open_lines, read_raw_lines, strip_ending
+from n_machine.reservoir import DEFAULT_SEED, RandomStream, Reservoir, bernoulli_sample
+from n_machine.resources import DEFAULT_CACHE_DIR, DEFAULT_DECLARERS, DEFAULT_PRONOUNS_DIR, DEFAULT_USERLIST, USERLIST_BACKENDS, Resources
+from n_machine.spill import MemoryCap, SpillFile, peak_rss_mb
+from n_machine.stats import STATS_FILE_ENDING, STATS_FILE_PREFIX, ProgressLog, Stats
+from n_machine.userlist import DEFAULT_BITS_PER_AUTHOR, convert_userlist, table_paths
+from n_machine.writers import COMMENT_FORMATS, FORMATS, Writer, check_format, default_format, open_writer, output_ending
+
+# the pronoun lists, userlist, and declarers, loaded on first use
+resources = Resources()
+
+def reset_reservoirs(year: int, month: int, seed: int) -> dict:
+    'returns an empty reservoir of size K for each of the subs that have declarers in the given month, each with its own random stream'
+    return {sub: Reservoir(k, RandomStream(seed, year, month, sub)) for sub, k in resources.k_index.get((year, month), {}).items()}
+    
 
-pronouns_bars = '|'.join(pronouns)
-pronouns_regex = f'(?:{pronouns_bars})'
-pronouns_regex = f'\\b{pronouns_regex}/{pronouns_regex}\\b'
-
-free_pronoun_regex = '(.+)/\\2s(elf)?\\b'
-
-noanyall_regex = "(no|any|all).pronouns?"
+def generate_k(subreddit: str, year:int, month:int, index=None):
+    index = resources.k_index if index is None else index
+    return index.get((year, month), {}).get(subreddit, 0)
 
-combined_regexes = '|'.join([pronouns_regex, free_pronoun_regex, noanyall_regex])
-combined_negative_regex = f'(?:({combined_regexes}))'
 
-# comparison data
-path = os.path.expanduser("~/Documents/GitHub/n_machine/assets/pronoun_declarers.pkl")
-declarers = pd.read_pickle(path)
+# the rest of a quoted line, from right after the quote symbol on
+QUOTED_LINE = re.compile('&gt;[^\n]+')
 
 
-# Results data
-subs = declarers['subreddit'].unique().tolist()
+@lru_cache(maxsize=None)
+def search_regex(regex: str, case_sensitive: bool) -> re.Pattern:
+    """Compile the comment regex, once per process."""
+    return re.compile(regex, 0 if case_sensitive else re.IGNORECASE)
 
-def reset_reservoir_and_results():
-    'returns an empty reservoir and per-sub results for the subs we are interested in'
-    reservoir = dict()
-    monthly_results = dict()
-    for sub in subs:
-        monthly_results.setdefault(sub, [])
-        reservoir.setdefault(sub, {'N':0, 'K':0})
-    return monthly_results, reservoir
-    
 
-def generate_k(subreddit: str, year:int, month:int, data=declarers):
-    count = ((data['year'] == year) & (data['month'] == month) & (data['subreddit'] == subreddit)).sum()
-    return count
+def find_all_matches(text, regex: re.Pattern):
+    """Iterate through all regex matches in a text, yielding the span of each as tuple."""
+    for match in regex.finditer(text):
+        yield match.span()
 
 
-def find_all_matches(text, regex):
-    """Iterate through all regex matches in a text, yielding the span of each as tuple."""
-    r = re.compile(regex)
-    for match in r.finditer(text):
-        yield (match.start(), match.end())
+def quote_spans(text: str) -> list:
+    """
+    Find the parts of a text that are quoted, in a single pass over it.
+    Quoted lines in Reddit data begin with "&gt;", and a match counts as quoted if it ends after a quote symbol on the same line.
+    Return the sorted (start, end) positions where such matches can end, for inside_quote().
+    """
+    return [(match.start() + 5, match.end()) for match in QUOTED_LINE.finditer(text)]
 
 
-def inside_quote(text: str, span: tuple) -> bool:
+def inside_quote(quotes: list, span: tuple) -> bool:
     """
-    Test if a span-marked match is inside a quoted line.
-    Such lines in Reddit data begin with "&gt;".
+    Test if a span-marked match is inside a quoted line, given the quote spans of the text.
+    It is if there is no linebreak between a quote symbol and the end of the match, other than one right at its end.
     """
     end = span[1]
-    relevant_text = text[:end]
-    return True if re.search('&gt;[^\n]+$', relevant_text) else False # tests if there is no linebreak between a quote symbol and the match
+    i = bisect.bisect_right(quotes, (end, math.inf)) - 1
+    return i >= 0 and end <= quotes[i][1] + 1
 
 
-def extract(args, comment: dict, outfile: TextIO):
+def matching_spans(text: str, args: argparse.Namespace):
+    """Iterate over the spans of the comment regex's matches in a text, leaving out those inside quoted lines unless --include_quoted."""
+    matches = find_all_matches(text, search_regex(args.commentregex, args.case_sensitive))
+    if args.include_quoted or '&gt;' not in text:
+        yield from matches
+        return
+    quotes = quote_spans(text)
+    for span in matches:
+        if not inside_quote(quotes, span):
+            yield span
+
+
+def extract(args, comment: dict, writer: Writer):
     """
     Extract a comment text and all relevant metadata.
     If no regex is supplied, extract the whole comment leaving the span field blank.
@@ -118,8 +130,7 @@ def extract(args, comment: dict, outfile: TextIO):
     """
     
     if args.return_all:
-        comment = json.dumps(comment)
-        _=outfile.write(comment+'\n')
+        writer.write_comment(comment)
     
     else:
         text = comment['body']
@@ -129,18 +140,19 @@ def extract(args, comment: dict, outfile: TextIO):
         score = comment['score']
         date = comment['created_utc']
         
-        # assemble a standard Reddit URL for older data
-        url_base = "https://www.reddit.com/r/"+subreddit+"/comments/"
-        oldschool_link = url_base + comment['link_id'].split("_")[1] + "//" + comment['id']
-
-        # choose the newer "permalink" metadata instead if available
-        permalink = "https://www.reddit.com" + comment['permalink'] if 'permalink' in comment.keys() else oldschool_link
-
-        csvwriter = csv.writer(outfile, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        # choose the newer "permalink" metadata if available
+        # and assemble a standard Reddit URL for older data otherwise
+        if comment.get('permalink') is not None:
+            permalink = "https://www.reddit.com" + comment['permalink']
+        else:
+            permalink = f"https://www.reddit.com/r/{subreddit}/comments/{comment['link_id'].split('_')[1]}//{comment['id']}"
 
-        span = None
-        row = [text, span, subreddit, score, user, flairtext, date, permalink]
-        csvwriter.writerow(row)
+        if args.commentregex is None:
+            span = None
+            writer.write_row((text, span, subreddit, score, user, flairtext, date, permalink))
+        else:
+            for span in matching_spans(text, args):
+                writer.write_row((text, str(span), subreddit, score, user, flairtext, date, permalink))
 
 
 def filter(comment: dict, popularity_threshold: int) -> tuple:
@@ -162,88 +174,288 @@ def filter(comment: dict, popularity_threshold: int) -> tuple:
     return False, None
 
 
-def relevant(comment: dict, args: argparse.Namespace, subs, baseline_nr) -> bool:
+def rejection_reason(comment: dict, args: argparse.Namespace, subs, baseline_nr):
     """
-    Test if a Reddit comment is at all relevant to the search.
+    Return why a Reddit comment is not at all relevant to the search, as one of stats.REASONS, or None if it is relevant.
     This is for broad criteria so negatives are discarded.
-    The filters are ordered by how unlikely they are to pass for efficiency.
+    The filters are ordered by how unlikely they are to pass for efficiency, and the cheap ones come first:
+    the search options --toplevel and --sample right after the subreddit, the comment regex last.
     """
 
     if comment['subreddit'] not in subs and baseline_nr == 1: 
-        return False
+        return 'subreddit'
     elif comment['subreddit'] in subs and baseline_nr == 2:
-        return False
+        return 'subreddit'
+
+    if args.toplevel and not (comment.get('parent_id') or '').startswith('t3_'):
+        return 'toplevel'
+    if args.sample is not None and not bernoulli_sample(comment['id'], args.seed, args.sample):
+        return 'sample'
     
-    filtered, _ = filter(comment, args.popularity) if not args.dont_filter else False, None
-    filtered = filtered[0]
-    if filtered:
-        return False
+    if not args.dont_filter:
+        filtered, reason = filter(comment, args.popularity)
+        if filtered:
+            return 'score' if reason == "score below defined threshold" else 'bot'
 
     if comment['author_flair_text'] is None:
         pass
     else:
-        search = re.search(combined_negative_regex, comment['author_flair_text']) if args.case_sensitive else re.search(combined_negative_regex, comment['author_flair_text'], re.IGNORECASE)
-        if search:
-            return False
+        if resources.flair_matcher(args.case_sensitive).declares(comment['author_flair_text']):
+            return 'flair'
     
-    return True if comment['author'] not in userlist else False
-         
+    if comment['author'] in resources.userlist:
+        return 'userlist'
+
+    if args.commentregex is not None and next(matching_spans(comment['body'], args), None) is None:
+        return 'regex'
+    return None
+
+
+def relevant(comment: dict, args: argparse.Namespace, subs, baseline_nr) -> bool:
+    """Test if a Reddit comment is at all relevant to the search."""
+    return rejection_reason(comment, args, subs, baseline_nr) is None
 
 
-def write_csv_headers(outfile_path: str):
-    """Write the headers for both the results file and the file for filtered-out hits."""
-    with open(outfile_path, 'a', encoding='utf-8') as outf:
-        headers = ['text', 'span', 'subreddit', 'score', 'user', 'flairtext', 'date', 'permalink']
-        csvwriter = csv.writer(outf, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        csvwriter.writerow(headers)
+def make_prefilter(filters: list, rejections: Counter = None, toplevel: bool = False):
+    """
+    Return a test that rejects raw comment lines relevant() would discard anyway, without decoding them.
+    The filters are (subs, baseline_nr) pairs as passed to relevant(), and a line is rejected only if all of them would discard it.
+    Only the subreddit, the parent with --toplevel, and the author are looked up in the raw line. The test never rejects a line relevant()
+    would keep, so the remaining checks are left to relevant() on the decoded comment.
+    Rejected lines are counted in rejections by the reason of each filter, as in Stats.rejections.
+    """
+    # whether comments of the subs are wanted (baseline 1) or unwanted (baseline 2)
+    filters = [({sub.encode() for sub in subs}, baseline_nr == 1) for subs, baseline_nr in filters]
+    userlist = resources.userlist
+    rejections = Counter() if rejections is None else rejections
+    by_subreddit = ('subreddit',) * len(filters)
+
+    def reject(subreddit, reason: str) -> bool:
+        """Count a rejected line, under the subreddit for the filters that don't want it anyway."""
+        if subreddit is None:
+            rejections[(reason,) * len(filters)] += 1
+        else:
+            rejections[tuple('subreddit' if (subreddit.group(1) in subs) != wanted else reason for subs, wanted in filters)] += 1
+        return False
 
+    def prefilter(line: bytes) -> bool:
+        subreddit = decoding.subreddit_field.search(line)
+        if subreddit is not None and all((subreddit.group(1) in subs) != wanted for subs, wanted in filters):
+            rejections[by_subreddit] += 1
+            return False
+        if toplevel:
+            match = decoding.parent_field.search(line)
+            if match is not None and not match.group(1).startswith(b't3_'):
+                return reject(subreddit, 'toplevel')
+        match = decoding.author_field.search(line)
+        if match is not None and match.group(1).decode() in userlist:
+            return reject(subreddit, 'userlist')
+        return True
 
-def read_redditfile(file: str):
+    return prefilter
+
+
+def read_redditfile(file: str, prefilter=None, decode=None, chunk_size: int = DEFAULT_CHUNK_SIZE, threads: int = 1):
     """
-    Iterate over the pushshift JSON lines, yielding them as Python dicts.
-    Decompress iteratively if necessary.
+    Iterate over the pushshift JSON lines, yielding them as Python dicts,
+    or as whatever else the given decode function turns a line into.
+    If a prefilter is given, only the lines it accepts are decoded.
     """
-    # older files in the dataset are uncompressed while newer ones use zstd compression and have .xz, .bz2, or .zst endings
-    if not file.endswith('.bz2') and not file.endswith('.xz') and not file.endswith('.zst'):
-        with open(file, 'r', encoding='utf-8') as infile:
-            for line in infile:
-                l = json.loads(line)
-                yield(l)
+    decode = decoding.loads if decode is None else decode
+    for line in read_raw_lines(file, chunk_size, threads):
+        if prefilter is None or prefilter(line):
+            yield decode(line)
+
+
+@contextmanager
+def open_month_lines(file: str, args: argparse.Namespace, filters: list, start_offset: int = 0):
+    """
+    Open a month's dump for reading its lines from a decompressed offset on.
+    If the dump has an up-to-date index and can be seeked in, only the frames that hold comments
+    any of the filters may keep are read. Otherwise the whole dump is read through.
+    """
+    index = None if args.no_index else load_index(file)
+    if index is not None and index['seekable']:
+        frames = wanted_frames(index, filters)
+        logging.info(f"Reading {len(frames):,} of {len(index['frames']):,} frames of {file} using its index")
+        with open(file, 'rb') as file_handle:
+            yield FrameReader(file_handle, index, frames, start_offset)
     else:
-        for comment, some_int in read_lines_zst(file):
-            yield json.loads(comment)
+        with open_lines(file, args.chunk_size * 2**20, args.decompress_threads, start_offset, args.prefetch) as lines:
+            yield lines
+
+
+def read_line_blocks(lines, block_size: int, stats: Stats = None):
+    """
+    Iterate over the pushshift JSON lines of an opened dump in lists of up to block_size undecoded lines.
+    Each block comes with the decompressed and compressed offsets right after its last line.
+    The time spent reading and decompressing is added to stats if given.
+    """
+    iterator = iter(lines)
+    while True:
+        start = time.perf_counter()
+        block = list(itertools.islice(iterator, block_size))
+        if stats is not None:
+            stats.time('read', start)
+        if not block:
+            break
+        yield block, lines.decompressed_offset, lines.compressed_offset
+
+
+# lines that are filtered at once when decoding in the reading process, and between calls of the progress function
+SEQUENTIAL_BLOCK_SIZE = 4096
 
-def read_and_decode(reader, chunk_size, max_window_size, previous_chunk=None, bytes_read=0):
-	chunk = reader.read(chunk_size)
-	bytes_read += chunk_size
-	if previous_chunk is not None:
-		chunk = previous_chunk + chunk
-	try:
-		return chunk.decode()
-	except UnicodeDecodeError:
-		if bytes_read > max_window_size:
-			raise UnicodeError(f"Unable to decode frame after reading {bytes_read:,} bytes")
-		logging.info(f"Decoding error with {bytes_read:,} bytes, reading another chunk")
-		return read_and_decode(reader, chunk_size, max_window_size, chunk, bytes_read)
+# state of a decode worker process, set once per month by init_decode_worker()
+decode_worker_state = {}
 
 
-def read_lines_zst(file_name):
-	with open(file_name, 'rb') as file_handle:
-		buffer = ''
-		reader = ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle)
-		while True:
-			chunk = read_and_decode(reader, 2**27, (2**29) * 2)
+def comment_decoder(args: argparse.Namespace):
+    """Return the function to decode comments with: full dicts are only needed to return them whole."""
+    return decoding.loads if args.return_all else decoding.decode_comment
 
-			if not chunk:
-				break
-			lines = (buffer + chunk).split("\n")
 
-			for line in lines[:-1]:
-				yield line, file_handle.tell()
+def init_decode_worker(args: argparse.Namespace, filters: list):
+    """Set up a decode worker process with the search parameters of the month it works on."""
+    decoding.use_backend(args.json_backend)
+    configure_resources(args)
+    stats = Stats()
+    decode_worker_state['args'] = args
+    decode_worker_state['filters'] = filters
+    decode_worker_state['stats'] = stats
+    decode_worker_state['prefilter'] = make_prefilter(filters, stats.rejections, args.toplevel)
 
-			buffer = lines[-1]
 
-		reader.close() 
+def filter_reasons(comment, args: argparse.Namespace, filters: list) -> tuple:
+    """Return the rejection reason of each filter for a decoded comment, which is None for the filters it is relevant to."""
+    return tuple(rejection_reason(comment, args, subs, baseline_nr) for subs, baseline_nr in filters)
+
+
+@lru_cache(maxsize=None)
+def relevant_filters(reasons: tuple) -> tuple:
+    """Return the indices of the filters a comment is relevant to, from its rejection reasons."""
+    return tuple(i for i, reason in enumerate(reasons) if reason is None)
+
+
+def filter_lines(block: list, args: argparse.Namespace, filters: list, prefilter, decode, stats: Stats) -> list:
+    """
+    Decode a block of raw lines, returning only the relevant comments, each together with the indices of the filters it is relevant to.
+    With --batch_size, the block is tested with vectorised operations on its columns and only the relevant lines are decoded.
+    Blocks that can't be decoded into columns, eg. because of unusual field types in some of the older dumps, are filtered line by line.
+    Each stage is counted and timed in stats, along with the rejection reasons of all lines.
+    """
+    start = time.perf_counter()
+    stats.counters['lines'] += len(block)
+    reasons = None
+    if args.batch_size is not None:
+        from n_machine import batch # imports pandas, which is slow and only needed here
+        try:
+            reasons = batch.rejection_reasons(block, filters, args.popularity, args.dont_filter,
+                                              resources.flair_matcher(args.case_sensitive), resources.userlist)
+        except ValueError as e:
+            logging.debug(f"Filtering a block line by line, it can't be decoded into columns: {e}")
+        start = stats.time('batch', start)
+
+    if reasons is not None:
+        stats.rejections.update(reasons)
+        lines = [(line, relevant_filters(line_reasons)) for line, line_reasons in zip(block, reasons)]
+        comments = [(decode(line), matches) for line, matches in lines if matches]
+        stats.counters['decoded'] += len(comments)
+        stats.time('decode', start)
+    else:
+        lines = [line for line in block if prefilter(line)]
+        start = stats.time('prefilter', start)
+        decoded = [decode(line) for line in lines]
+        stats.counters['decoded'] += len(decoded)
+        start = stats.time('decode', start)
+        reasons = [filter_reasons(comment, args, filters) for comment in decoded]
+        stats.rejections.update(reasons)
+        comments = [(comment, relevant_filters(comment_reasons)) for comment, comment_reasons in zip(decoded, reasons)]
+        comments = [(comment, matches) for comment, matches in comments if matches]
+        stats.time('relevant', start)
+
+    stats.subreddits.update(comment['subreddit'] for comment, _ in comments)
+    return comments
+
+
+def filter_block(block: list) -> tuple:
+    """
+    Decode a block of raw lines in a decode worker, returning only the relevant comments,
+    each together with the indices of the filters it is relevant to.
+    The worker's process id, its flair matcher stats so far, and the stats of the block are returned along with them.
+    """
+    args = decode_worker_state['args']
+    stats = decode_worker_state['stats']
+    comments = filter_lines(block, args, decode_worker_state['filters'], decode_worker_state['prefilter'], comment_decoder(args), stats)
+    return comments, os.getpid(), resources.flair_matcher(args.case_sensitive).stats(), stats.take()
+
+
+def relevant_comments(file: str, args: argparse.Namespace, filters: list, start_offset: int = 0, progress=None, stats: Stats = None):
+    """
+    Iterate over the comments of a data dump that are relevant to any of the filters, in file order,
+    starting at a decompressed offset. Each comment is yielded together with the indices of the filters it is relevant to,
+    so that a single pass over the dump serves all baselines and counts of a run.
+    With more than one decode worker, the main process only reads and splits the dump into blocks of lines,
+    while the worker processes decode and filter them. Results are collected in submission order
+    and the number of blocks in flight is bounded, so memory use stays flat however fast the reader is.
+    The progress function, if given, is regularly called with the decompressed and compressed offsets
+    up to which every comment has been handed out and processed by the caller. Reading stops early if it returns True.
+    Every stage is counted and timed in stats if given, including the time the caller spends on the comments it is handed.
+    The flair matcher stats of the month are put into stats once the dump is read.
+    """
+    stats = Stats() if stats is None else stats
+    matcher = resources.flair_matcher(args.case_sensitive)
+    if args.decode_workers == 1:
+        before = matcher.stats()
+        prefilter = make_prefilter(filters, stats.rejections, args.toplevel)
+        decode = comment_decoder(args)
+        with open_month_lines(file, args, filters, start_offset) as lines:
+            for block, decompressed_offset, compressed_offset in read_line_blocks(lines, args.batch_size or SEQUENTIAL_BLOCK_SIZE, stats):
+                comments = filter_lines(block, args, filters, prefilter, decode, stats)
+                start = time.perf_counter()
+                yield from comments
+                stats.time('sampling', start)
+                if progress is not None and progress(decompressed_offset, compressed_offset):
+                    break
+        stats.flair_matcher = matcher.stats(since=before)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=args.decode_workers, initializer=init_decode_worker, initargs=(args, filters))
+    pending = deque()
+    worker_stats = dict() # latest flair matcher stats per worker process, which only live for this month
+
+    def collect(future):
+        start = time.perf_counter()
+        comments, pid, matcher_stats, block_stats = future.result()
+        stats.time('waiting for workers', start)
+        worker_stats[pid] = matcher_stats
+        stats.add(block_stats)
+        return comments
+
+    def collect_oldest():
+        """Yield the comments of the oldest block, then return whether reading can stop."""
+        future, decompressed_offset, compressed_offset = pending.popleft()
+        comments = collect(future)
+        start = time.perf_counter()
+        yield from comments
+        stats.time('sampling', start)
+        return progress is not None and progress(decompressed_offset, compressed_offset)
+
+    try:
+        with open_month_lines(file, args, filters, start_offset) as lines:
+            for block, decompressed_offset, compressed_offset in read_line_blocks(lines, args.batch_size or args.block_size, stats):
+                pending.append((pool.submit(filter_block, block), decompressed_offset, compressed_offset))
+                if len(pending) >= 2 * args.decode_workers and (yield from collect_oldest()):
+                    break
+            else:
+                while pending:
+                    if (yield from collect_oldest()):
+                        break
+    finally:
+        pool.shutdown(cancel_futures=True)
+    matcher_stats = dict()
+    for worker in worker_stats.values():
+        matcher_stats = add_stats(matcher_stats, worker)
+    stats.flair_matcher = matcher_stats
 
 
 def within_timeframe(month: str, time_from: tuple, time_to: tuple) -> bool:
@@ -272,14 +484,17 @@ def within_timeframe(month: str, time_from: tuple, time_to: tuple) -> bool:
     return True
 
 
+def is_month_file(name: str) -> bool:
+    """Test if a file in the input directory is a monthly data dump, ie. named 'RC_YYYY-MM' plus a codec ending if compressed."""
+    return re.search(r'^R[CS]_\d{4}-\d{2}$', strip_ending(name)) is not None
+
+
 def fetch_data_timeframe(input_dir: str) -> tuple:
     """
     Establish a timeframe based on all directories found in the input directory.
     Used when no timeframe was given by user.
     """
-    months = [elem.replace("RC_", "") for elem in os.listdir(input_dir) if not elem.endswith(".txt")]
-    months = [elem.replace("RS_", "") for elem in months]
-    months = [elem.replace(".zst", "") for elem in months if elem.endswith('.zst')]
+    months = [strip_ending(elem)[3:] for elem in os.listdir(input_dir) if is_month_file(elem)] # remove the "RC_" or "RS_" prefix
 
     months = sorted(months)
     months = [(int(elem.split("-")[0]), int(elem.split("-")[1])) for elem in months]
@@ -288,7 +503,7 @@ def fetch_data_timeframe(input_dir: str) -> tuple:
 
 def establish_timeframe(time_from: tuple, time_to: tuple, input_dir: str, reverse_order: bool) -> list:
     """Return all months of the data within a timeframe as list of directories."""
-    months = [elem for elem in os.listdir(input_dir) if elem.startswith("RC") or elem.startswith("RS")] # all available months in the input directory
+    months = [elem for elem in os.listdir(input_dir) if is_month_file(elem)] # all available months in the input directory
     reverse = False if not reverse_order else True
     
     return sorted([month for month in months if within_timeframe(month, time_from, time_to)], reverse=reverse)
@@ -360,12 +575,12 @@ def comment_regex(string) -> str:
     return regex
 
 
-def assemble_outfile_name(args: argparse.Namespace, month) -> str:
+def assemble_outfile_name(args: argparse.Namespace, month, prefix: str, ending: str) -> str:
     """
-    Assemble the outfile name out of the search parameters in human-readable and sanitized form.
+    Assemble an outfile name out of its prefix and file ending and the search parameters in human-readable and sanitized form.
     Full path is returned.
     """
-    outfile_name = f"baseline-{args.baseline_nr}_reservoir-sampled_based-on_pronoun-declarers_from-month_"
+    outfile_name = prefix
 
     # add timeframe info
     # this allows for the name to make sense with any or both of the timeframe bounds absent or present
@@ -381,7 +596,7 @@ def assemble_outfile_name(args: argparse.Namespace, month) -> str:
     # specify the month of the reddit data
     outfile_name = outfile_name + "_" + month if month is not None else outfile_name
     # add file ending
-    outfile_name += ".csv" if not args.return_all else ".jsonl"
+    outfile_name += ending
 
     return outfile_name
 
@@ -402,6 +617,20 @@ def define_parser() -> argparse.ArgumentParser:
     parser.add_argument('--time_to', '-T', type=valid_date, required=False,
                         help="The end of the timeframe to be searched, in the format YYYY-MM. If absent, a timeframe is assumed with no upper bound.")
     
+    # comparison data
+    parser.add_argument('--pronouns_dir', default=DEFAULT_PRONOUNS_DIR,
+                        help=f"The directory containing the pronoun lists. Defaults to {DEFAULT_PRONOUNS_DIR}")
+    parser.add_argument('--userlist', default=DEFAULT_USERLIST,
+                        help=f"The pickled list of users to exclude. Defaults to {DEFAULT_USERLIST}")
+    parser.add_argument('--userlist_backend', choices=USERLIST_BACKENDS, default='set',
+                        help="How the userlist is held in memory: as a set in every process, or memory-mapped from the hash table the userlist command converts it into, which every process shares and which takes a fraction of the memory. Defaults to set.")
+    parser.add_argument('--declarers', default=DEFAULT_DECLARERS,
+                        help=f"The pickled DataFrame of pronoun declarers. Defaults to {DEFAULT_DECLARERS}")
+    parser.add_argument('--cache_dir', default=DEFAULT_CACHE_DIR,
+                        help=f"Where the comparison data is cached after it's first loaded. Defaults to {DEFAULT_CACHE_DIR}")
+    parser.add_argument('--no_cache', action='store_true',
+                        help="Always load the comparison data from the source files.")
+    
     # search parameters
     parser.add_argument('--commentregex', '-CR', type=comment_regex, required=False,
                         help="The regex to search the comments with. If absent, all comments matching the other parameters will be extracted. Can be a filepath of a file that contains the regex.")
@@ -418,19 +647,55 @@ def define_parser() -> argparse.ArgumentParser:
     
     # special
     parser.add_argument('--count', '-C', action='store_true',
-                        help="Only counts the relevant comments per month and prints the statistic to console.")
+                        help="Counts the relevant comments per subreddit and month, along with the reasons the other comments were rejected, into an SQLite store. Months already counted into the store with the same parameters are skipped. Without an output directory or --count_store, the counts are printed to console.")
+    parser.add_argument('--count_store', required=False,
+                        help=f"The SQLite file to store the counts in. Defaults to {COUNT_STORE_NAME} in the output directory.")
     parser.add_argument('--include_quoted', action='store_true',
                         help="Include regex matches that are inside Reddit quotes (lines starting with >, often but not exclusively used to quote other Reddit users)")
     parser.add_argument('--sample', '-SMP', type=sample_float, required=False,
-                        help="Retrieve a sample of results fitting the other parameters. Sample size is given as float between 0.0 and 1.0 where 1.0 returns 100% of results")
+                        help="Retrieve a sample of results fitting the other parameters. Sample size is given as float between 0.0 and 1.0 where 1.0 returns 100%% of results. Whether a comment is sampled only depends on its id and --seed.")
     parser.add_argument('--return_all', action='store_true', required=False,
                         help="Will return every search hit in its original and complete JSON form.")
+    parser.add_argument('--output_format', choices=FORMATS, required=False,
+                        help="Format of the output files: semicolon CSV, JSON lines, either zstd-compressed, or Parquet or Arrow IPC with the columns of the CSV (needs pyarrow). Defaults to csv, or jsonl with --return_all.")
     parser.add_argument('--dont_filter', action='store_true', required=False,
                         help="Skip any filtering.")
-    parser.add_argument('--baseline_nr', type=int, required=True,
-                        help="What kind of baseline is wanted, 1 or 2.")
+    parser.add_argument('--baseline_nr', type=int, nargs='*', default=[],
+                        help="What kind of baseline is wanted, 1 or 2. Both can be given to sample them in the same pass over the data.")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                        help="Seed of the reservoir sampling. Every month and subreddit gets its own random stream derived from it, so the same seed always draws the same baseline. Defaults to 0.")
     parser.add_argument('--reverse_order', action='store_true', required=False,
-                        help="Process months from latest to earliest.")                    
+                        help="Process months from latest to earliest.")
+    parser.add_argument('--workers', '-W', type=int, default=1,
+                        help="Number of months to process in parallel, each in its own process. Defaults to 1, ie. sequential processing.")
+    parser.add_argument('--decode_workers', '-DW', type=int, default=1,
+                        help="Number of processes that decode and filter the lines of a single month's dump, while the main process reads it. Defaults to 1, ie. decoding in the reading process.")
+    parser.add_argument('--json_backend', choices=['auto'] + decoding.BACKENDS, default='auto',
+                        help="The library used to decode the JSON lines. By default the fastest installed one is used (msgspec, then orjson, then the standard library).")
+    parser.add_argument('--chunk_size', type=int, default=DEFAULT_CHUNK_SIZE // 2**20,
+                        help="Size in MiB of the chunks the data dumps are read and decompressed in. Defaults to 128.")
+    parser.add_argument('--decompress_threads', type=int, default=1,
+                        help="Number of threads to decompress .xz, .bz2, and .gz dumps with, using xz, lbzip2, or pigz if installed. zstd decompression is always single-threaded.")
+    parser.add_argument('--prefetch', type=int, default=0, metavar='N',
+                        help="Read and decompress up to N chunks of --chunk_size, but at most 16 MiB, ahead of the lines being filtered, in a background thread that also asks the kernel to read the dump ahead. Overlaps reading with filtering, which helps most on network storage. Not used for dumps read through their index. Defaults to 0, ie. no prefetching.")
+    parser.add_argument('--block_size', type=int, default=20000,
+                        help="Number of lines sent to a decode worker at once. Only used with --decode_workers.")
+    parser.add_argument('--bounded_scan', type=float, required=False, metavar='C',
+                        help="Stop reading a month once every reservoir has seen at least C times as many relevant comments as it keeps, and --min_fraction of the month was read. Reservoirs are then uniform samples of the part of the month that was read only, which is recorded per subreddit in a .budget.json report next to each output file. Can't be combined with --count.")
+    parser.add_argument('--min_fraction', type=float, default=0.1,
+                        help="The fraction of a month that is read at least with --bounded_scan, between 0 and 1. Defaults to 0.1.")
+    parser.add_argument('--no_index', action='store_true',
+                        help="Read the dumps from start to end even if they have an index.")
+    parser.add_argument('--batch_size', type=int, required=False,
+                        help="Filter the lines in blocks of this many, decoding each block into columns (with pyarrow if installed, pandas otherwise) and testing them with vectorised operations. 50000 to 100000 works well. Pays off when most comments are relevant, eg. for baseline 1 over many subs; for selective filters the per-line prefilter is faster. Also the block size sent to decode workers.")
+    parser.add_argument('--reservoir_memory_mb', type=float, required=False,
+                        help="Cap in MiB on the estimated memory the sampled comments of a month take. Once the reservoirs reach it, their comments are spilled to a file next to the output file and read back when the month is written. The peak RSS is logged and recorded in the stats of each month either way.")
+    parser.add_argument('--progress_interval', type=float, default=60,
+                        help="Seconds between progress lines in the log, with the throughput and the time left for the month. Defaults to 60, 0 disables them.")
+    parser.add_argument('--checkpoint_interval', type=float, default=900,
+                        help="Seconds between checkpoints of a month's sampling state, from which an interrupted run resumes. Defaults to 900, 0 disables checkpoints.")
+    parser.add_argument('--restart', action='store_true',
+                        help="Process all months from scratch, ignoring months finished and checkpoints saved by earlier runs with the same parameters.")
 
     return parser
 
@@ -440,7 +705,7 @@ def handle_args() -> argparse.Namespace:
     parser = define_parser()
     args = parser.parse_args()
 
-    if args.output is None and not args.count:
+    if args.output is None and args.baseline_nr:
         parser.error("Since you're not just counting, you need to supply an output directory.")
 
     # ensure that the timeframe makes sense (either the from-year is later than to-year, or the from-month is later than to-month in the same year)
@@ -453,28 +718,219 @@ def handle_args() -> argparse.Namespace:
         logging.info("No timeframe supplied. Searching all months found in the input directory.")
         args.time_from, args.time_to = fetch_data_timeframe(args.input)
     
-    if args.baseline_nr != 1 and args.baseline_nr != 2:
-         parser.error("Baseline Nr is required and must be either 1 or 2.")
+    if not args.baseline_nr and not args.count:
+        parser.error("Baseline Nr is required unless counting.")
+    if args.count_store is not None and not args.count:
+        parser.error("argument --count_store only applies to --count")
+    if args.count and args.count_store is None and args.output is not None:
+        args.count_store = os.path.join(args.output, COUNT_STORE_NAME)
+    if any(baseline_nr not in (1, 2) for baseline_nr in args.baseline_nr):
+        parser.error("Baseline Nr must be either 1 or 2.")
+    args.baseline_nr = sorted(set(args.baseline_nr))
+
+    if args.output_format is None:
+        args.output_format = default_format(args.return_all)
+    elif args.return_all and args.output_format not in COMMENT_FORMATS:
+        parser.error(f"--return_all writes whole comments, which only works with the output formats {', '.join(COMMENT_FORMATS)}")
+    try:
+        check_format(args.output_format)
+    except ImportError as e:
+        parser.error(str(e))
+
+    if args.seed < 0:
+        parser.error("argument --seed must not be negative")
+
+    if args.workers < 1:
+        parser.error("argument --workers must be at least 1")
+    if args.decode_workers < 1:
+        parser.error("argument --decode_workers must be at least 1")
+    if args.block_size < 1:
+        parser.error("argument --block_size must be at least 1")
+    if args.batch_size is not None and args.batch_size < 1:
+        parser.error("argument --batch_size must be at least 1")
+    if args.batch_size is not None and (args.commentregex is not None or args.toplevel or args.sample is not None):
+        parser.error("argument --batch_size can't be combined with --commentregex, --toplevel, or --sample, which are tested line by line")
+    if args.chunk_size < 1:
+        parser.error("argument --chunk_size must be at least 1")
+    if args.decompress_threads < 1:
+        parser.error("argument --decompress_threads must be at least 1")
+    if args.prefetch < 0:
+        parser.error("argument --prefetch must not be negative")
+    if args.bounded_scan is not None:
+        if args.bounded_scan < 1:
+            parser.error("argument --bounded_scan must be at least 1, or reservoirs could stop before they are full")
+        if args.count:
+            parser.error("argument --bounded_scan can't be combined with --count, which needs every comment of a month")
+    if not 0 <= args.min_fraction <= 1:
+        parser.error("argument --min_fraction must be between 0 and 1")
+
+    if args.userlist_backend == 'hashed':
+        hashes_path = table_paths(os.path.expanduser(args.userlist))[0]
+        if not os.path.isfile(hashes_path) or os.path.getmtime(hashes_path) < os.path.getmtime(os.path.expanduser(args.userlist)):
+            parser.error(f"--userlist_backend hashed needs the userlist converted first, with: main.py userlist --userlist {args.userlist}")
+
+    if args.reservoir_memory_mb is not None and args.reservoir_memory_mb < 0:
+        parser.error("argument --reservoir_memory_mb must not be negative")
+    if args.progress_interval < 0:
+        parser.error("argument --progress_interval must not be negative")
+    if args.checkpoint_interval < 0:
+        parser.error("argument --checkpoint_interval must not be negative")
+
+    try:
+        decoding.use_backend(args.json_backend)
+    except ImportError as e:
+        parser.error(str(e))
 
     return args
 
 
+def define_index_parser() -> argparse.ArgumentParser:
+    """Define the argument parser of the index command."""
+    parser = argparse.ArgumentParser(prog="main.py index", description="Index the Pushshift data dumps by subreddit, optionally re-encoding them as seekable zstd")
+    parser.add_argument('--input', '-I', type=dir_path, required=True,
+                        help="The directory containing the Pushshift data dumps to index.")
+    parser.add_argument('--output', '-O', type=dir_path, required=False,
+                        help="If given, the dumps are re-encoded into this directory as seekable zstd, with their indexes next to them. Otherwise the indexes are saved next to the original dumps.")
+    parser.add_argument('--time_from', '-F', type=valid_date, required=False,
+                        help="The first month to index, in the format YYYY-MM.")
+    parser.add_argument('--time_to', '-T', type=valid_date, required=False,
+                        help="The last month to index, in the format YYYY-MM.")
+    parser.add_argument('--frame_size', type=int, default=DEFAULT_FRAME_SIZE // 2**20,
+                        help="Size in MiB of decompressed data per frame. Smaller frames let runs skip more of a dump, at a slightly worse compression ratio. Defaults to 8.")
+    parser.add_argument('--level', type=int, default=3,
+                        help="zstd compression level of the re-encoded dumps. Defaults to 3.")
+    parser.add_argument('--threads', type=int, default=0,
+                        help="Threads to compress each frame of the re-encoded dumps with. Defaults to 0, ie. compressing in the main thread.")
+    parser.add_argument('--totals', action='store_true',
+                        help="Instead of indexing, print the number of comments per subreddit in each indexed month.")
+    return parser
+
+
+def index_main(argv: list):
+    """Index the dumps of a directory, or print their subreddit totals."""
+    parser = define_index_parser()
+    args = parser.parse_args(argv)
+    if args.output is not None and os.path.realpath(args.output) == os.path.realpath(args.input):
+        parser.error("The re-encoded dumps can't be written into the input directory.")
+    if args.frame_size < 1:
+        parser.error("argument --frame_size must be at least 1")
+
+    for month in establish_timeframe(args.time_from, args.time_to, args.input, False):
+        dump = os.path.join(args.input, month)
+        if args.totals:
+            index = load_index(dump)
+            if index is None:
+                logging.info(f"{month} has no index")
+            else:
+                print(json.dumps({strip_ending(month): index['totals']}))
+            continue
+
+        log_month(month)
+        seekable_dump = os.path.join(args.output, strip_ending(month) + ".zst") if args.output is not None else None
+        index = build_index(dump, args.frame_size * 2**20, seekable_dump, args.level, args.threads)
+        save_index(index, index_path(seekable_dump if seekable_dump is not None else dump))
+        logging.info(f"Indexed {sum(frame[4] for frame in index['frames']):,} comments in {len(index['frames']):,} frames"
+                     f" and {len(index['totals']):,} subreddits")
+
+
+def define_userlist_parser() -> argparse.ArgumentParser:
+    """Define the argument parser of the userlist command."""
+    parser = argparse.ArgumentParser(prog="main.py userlist", description="Convert the userlist into a memory-mapped hash table with a Bloom filter, for --userlist_backend hashed")
+    parser.add_argument('--userlist', default=DEFAULT_USERLIST,
+                        help=f"The pickled list of users to convert. The hash table and Bloom filter are saved next to it. Defaults to {DEFAULT_USERLIST}")
+    parser.add_argument('--bits_per_author', type=int, default=DEFAULT_BITS_PER_AUTHOR,
+                        help="Size of the Bloom filter in bits per author. 10 bits turn away all but about 1%% of the authors not on the list before the hash table is searched. Defaults to 10.")
+    return parser
+
+
+def userlist_main(argv: list):
+    """Convert the userlist for the hashed backend."""
+    parser = define_userlist_parser()
+    args = parser.parse_args(argv)
+    if args.bits_per_author < 1:
+        parser.error("argument --bits_per_author must be at least 1")
+    userlist = os.path.expanduser(args.userlist)
+    if not os.path.isfile(userlist):
+        parser.error(f"{userlist} is not a file")
+
+    n, hashes_path, bloom_path = convert_userlist(userlist, args.bits_per_author)
+    logging.info(f"Converted {n:,} authors into {hashes_path} ({os.path.getsize(hashes_path) / 2**20:.1f} MiB)"
+                 f" and {bloom_path} ({os.path.getsize(bloom_path) / 2**20:.1f} MiB)")
+
+
+def define_counts_parser() -> argparse.ArgumentParser:
+    """Define the argument parser of the counts command."""
+    parser = argparse.ArgumentParser(prog="main.py counts", description="Query the counts stored by runs with --count, without reading the dumps")
+    parser.add_argument('--store', required=True,
+                        help=f"The SQLite file of the counts, {COUNT_STORE_NAME} in the output directory of the runs by default.")
+    parser.add_argument('--params', required=False,
+                        help="The start of the hash of the parameters to query the counts of, as listed by the runs query. Only needed if the store holds counts of more than one set of parameters.")
+    parser.add_argument('--time_from', '-F', type=valid_date, required=False,
+                        help="The first month to query, in the format YYYY-MM.")
+    parser.add_argument('--time_to', '-T', type=valid_date, required=False,
+                        help="The last month to query, in the format YYYY-MM.")
+    queries = parser.add_subparsers(dest='query', required=True)
+    queries.add_parser('runs', help="List the sets of parameters in the store, with the months counted for each.")
+    top = queries.add_parser('top', help="The subreddits with the most relevant comments in the timeframe.")
+    top.add_argument('-n', type=int, default=20, help="Number of subreddits. Defaults to 20.")
+    trend = queries.add_parser('trend', help="The relevant comments per month, in total or of the given subreddits.")
+    trend.add_argument('subreddits', nargs='*', help="The subreddits to list. If absent, the totals over all subreddits are listed.")
+    queries.add_parser('rejections', help="The number of comments rejected for each reason per month, and of the relevant ones.")
+    return parser
+
+
+def counts_main(argv: list):
+    """Answer a query from the count store, printing one JSON object per row."""
+    parser = define_counts_parser()
+    args = parser.parse_args(argv)
+    if not os.path.isfile(args.store):
+        parser.error(f"{args.store} is not a file")
+    store = CountStore(args.store)
+    if args.query == 'runs':
+        for run in store.runs():
+            print(json.dumps(run))
+        return
+    try:
+        params = store.resolve(args.params)
+    except ValueError as e:
+        parser.error(str(e))
+    month_from = f"{args.time_from[0]}-{args.time_from[1]:02d}" if args.time_from is not None else None
+    month_to = f"{args.time_to[0]}-{args.time_to[1]:02d}" if args.time_to is not None else None
+
+    if args.query == 'top':
+        for subreddit, comments in store.top(params, args.n, month_from, month_to):
+            print(json.dumps({'subreddit': subreddit, 'comments': comments}))
+    elif args.query == 'trend':
+        for month, subreddit, comments in store.trend(params, args.subreddits, month_from, month_to):
+            print(json.dumps({'month': month, 'subreddit': subreddit, 'comments': comments}))
+    elif args.query == 'rejections':
+        for month, reason, comments in store.rejections(params, month_from, month_to):
+            print(json.dumps({'month': month, 'reason': reason, 'comments': comments}))
+    store.close()
+
+
 def log_month(month: str):
     """Send a message to the log with a month's real name for better clarity."""
     month = month.replace("RC_", "")
     month = month.replace("RS_", "")
-    month = month.replace(".zst", "")
+    month = strip_ending(month)
     year = month.split("-")[0] # get year string from the format 'RC_YYYY-MM.zst'
     m_num = int(month.split("-")[1]) # get month integer
     m_name = calendar.month_name[m_num]
 
     logging.info("Processing " + m_name + " " + year)
 
+def month_key(month: str) -> str:
+    """Turn a dump's file name into the YYYY-MM its counts are stored under."""
+    month, year = parse_month(month)
+    return f"{year}-{month:02d}"
+
+
 def parse_month(month: str):
     "get year and month as integers from filename"
     month = month.replace("RC_", "")
     month = month.replace("RS_", "")
-    month = month.replace(".zst", "")
+    month = strip_ending(month)
     year = int(month.split("-")[0]) # get year string from the format 'RC_YYYY-MM.zst'
     month = int(month.split("-")[1]) # get month integer
     return month, year    
@@ -482,95 +938,255 @@ def parse_month(month: str):
 def get_data_file(path: str) -> str:
     """
     Find the correct file type of each month directory.
-    Files can be plain, zst, xz, or bz2.
+    Files can be plain, zst, xz, bz2, or gz.
     Throw error if no usable file is present in directory.
     """
-    for ending in ['', '.zst', '.xz', '.bz2']:
+    for ending in CODECS:
         if os.path.isfile(path+ending):
             return path+ending
-    logging.warning("Month directory " + dir + " does not contain a valid data dump file.")
+    logging.warning("Month directory " + path + " does not contain a valid data dump file.")
     exit()
 
 
-def process_month(month, args, outfile):
-    log_month(month)
+class BaselineSink:
+    """
+    The reservoir sample of baseline 1 or 2 for one month.
+    Baseline 1 samples K comments in each subreddit the declarers posted in, baseline 2 samples 2*K comments
+    overall from all other subreddits, where K is the number of declarers of the month.
+    With a memory cap, sampled comments are spilled to a file next to the output file once the month's reservoirs reach it.
+    """
 
-    infile = args.input + "/" + month
+    def __init__(self, baseline_nr: int, args: argparse.Namespace, year: int, month: int):
+        self.name = f"baseline-{baseline_nr}"
+        self.baseline_nr = baseline_nr
+        self.args = args
+        self.file_prefix = f"baseline-{baseline_nr}_reservoir-sampled_based-on_pronoun-declarers_from-month_"
+        self.file_ending = output_ending(args.output_format)
+
+        if baseline_nr == 1:
+            self.reservoirs = reset_reservoirs(year, month, args.seed)
+            self.subs = [sub for sub in resources.subs if sub in self.reservoirs]
+        elif baseline_nr == 2:
+            k = sum(resources.k_index.get((year, month), {}).values())
+            k = 2*k # to have more than enough
+            # a single reservoir for all subreddits
+            self.reservoirs = {None: Reservoir(k, RandomStream(args.seed, year, month))}
+            self.subs = resources.subs
+        self.spill_path = None
+        self.spill = None
+
+    def spill_to(self, path: str, cap: MemoryCap = None):
+        """Set the spill file of the reservoirs, which are only spilled if a memory cap is given."""
+        self.spill_path = path
+        if cap is not None:
+            self.spill = SpillFile(path, cap)
+
+    def is_idle(self) -> bool:
+        """Test if no comment can be sampled, ie. if nobody declared pronouns in the month."""
+        return all(reservoir.k == 0 for reservoir in self.reservoirs.values())
+
+    def add(self, comment) -> bool:
+        """Offer a comment to its reservoir, returning whether it replaced a comment sampled earlier."""
+        reservoir = self.reservoirs[comment['subreddit'] if self.baseline_nr == 1 else None]
+        if self.spill is None:
+            return reservoir.add(comment) and reservoir.n > reservoir.k
+        slot = reservoir.consider()
+        if slot is None:
+            return False
+        replaced = reservoir.place(slot, self.spill.keep(comment, self.reservoirs))
+        if replaced is None:
+            return False
+        self.spill.release(replaced)
+        return True
+
+    def state(self):
+        if self.spill is None:
+            return self.reservoirs
+        return self.reservoirs, self.spill.state()
+
+    def restore(self, state):
+        if not isinstance(state, tuple):
+            self.reservoirs = state
+            return
+        self.reservoirs, spill_state = state
+        if self.spill is None:
+            # spilled by an earlier run with a memory cap, which this one doesn't have
+            self.spill = SpillFile(self.spill_path, MemoryCap(math.inf))
+        self.spill.restore(spill_state, self.reservoirs)
+
+    def write(self, outfile: str):
+        decode = comment_decoder(self.args)
+        with open_writer(outfile, self.args.output_format) as writer:
+            for key in (self.subs if self.baseline_nr == 1 else [None]):
+                for comment in self.reservoirs[key]:
+                    if self.spill is not None:
+                        comment = self.spill.read(comment, decode)
+                    extract(self.args, comment, writer)
+        if self.spill is not None:
+            self.spill.close()
+
+
+class CountSink:
+    """The number of relevant comments per subreddit of the declarers in one month."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.name = "counts"
+        self.baseline_nr = 1 # counts are taken in the declarers' subreddits
+        self.subs = resources.subs
+        self.file_prefix = "counts_based-on_pronoun-declarers_from-month_"
+        self.file_ending = ".jsonl"
+        self.monthly_counts = {sub: 0 for sub in self.subs}
+        self.store = args.count_store
+
+    def is_idle(self) -> bool:
+        return False
 
-    month, year = parse_month(month)
-    
+    def add(self, comment) -> bool:
+        self.monthly_counts[comment['subreddit']] += 1
+        return False
 
-    if not args.count:
-        if args.baseline_nr == 1:
-            monthly_results, reservoir = reset_reservoir_and_results()
-            for sub in subs:
-                reservoir[sub]['K'] = generate_k(sub, year, month, declarers)
-            month_subs = [sub for sub in subs if reservoir[sub]['K'] > 0]
-        
-        elif args.baseline_nr == 2:
-            monthly_results = list()
-            k = ((declarers['year'] == year) & (declarers['month'] == month)).sum()
-            k = 2*k # to have more than enough
-            n = 0
-            month_subs = subs
+    def state(self):
+        return self.monthly_counts
 
-        for comment in read_redditfile(infile):
+    def restore(self, state):
+        self.monthly_counts = state
 
-            if args.baseline_nr == 1:
-                if month_subs == []:
-                    break
-            elif args.baseline_nr == 2:
-                if k == 0:
-                    break     
-
-            if relevant(comment, args, month_subs, args.baseline_nr):
-                if args.baseline_nr == 1:
-                    sub = comment['subreddit']
-                    k = reservoir[sub]['K']
-                    reservoir[sub]['N'] += 1
-                    n = reservoir[sub]['N']
-
-                    if len(monthly_results[sub]) < k:
-                        monthly_results[sub].append(comment)
-                    else:
-                        s = int(random.random() * n)
-                        if s < k:
-                            monthly_results[sub][s] = comment
-                
-                elif args.baseline_nr == 2:
-                    if len(monthly_results) < k:
-                        monthly_results.append(comment)
-                    else:
-                        n += 1
-                        s = int(random.random() * n)
-                        if s < k:
-                            monthly_results[s] = comment
-    
-    elif args.count:
-        monthly_counts = {sub: 0 for sub in subs}
+    def write(self, outfile: str):
+        if self.store is not None:
+            # stored by process_month() once the month's rejection reasons are known
+            return
+        data = json.dumps(self.monthly_counts)
+        if outfile is None:
+            print(data)
+            return
+        with open(outfile, "w", encoding="utf-8") as outf:
+            _=outf.write(data + '\n')
 
-        for comment in read_redditfile(infile):
-            if relevant(comment, args, subs):
-                 sub = comment['subreddit']
-                 monthly_counts[sub] += 1
 
+def month_sinks(args: argparse.Namespace, year: int, month: int) -> list:
+    """Return a sink for each baseline and for the counts asked for on the command line."""
+    sinks = [BaselineSink(baseline_nr, args, year, month) for baseline_nr in args.baseline_nr]
     if args.count:
-         outfile = re.sub('\.csv', '', outfile)
-         outfile = f'{outfile}.jsonl'
-
-    with open(outfile, "a", encoding="utf-8") as outf:
-        if not args.count:
-            if args.baseline_nr == 1:
-                for sub in list(monthly_results.keys()):
-                    for comment in monthly_results[sub]:
-                        extract(args, comment, outf)
-            elif args.baseline_nr == 2:
-                for comment in monthly_results:
-                    extract(args, comment, outf) 
-        
-        elif args.count:
-             data = json.dumps(monthly_counts)
-             _=outf.write(data)
+        sinks.append(CountSink(args))
+    return sinks
+
+
+def process_month(month, args, checkpoint=None, snapshot=None) -> dict:
+    """
+    Sample and count a month into one output file per sink, reading the month's dump only once.
+    If a snapshot from an earlier, interrupted run is given, sampling continues from its state and position in the dump.
+    Return the output files by sink name, which are None if there is no output directory.
+    """
+    log_month(month)
+
+    infile = args.input + "/" + month
+    month_name = month
+    start_offset = 0 if snapshot is None else snapshot['decompressed_offset']
+
+    month, year = parse_month(month)
+
+    stats = Stats()
+    sinks = month_sinks(args, year, month)
+    cap = MemoryCap(args.reservoir_memory_mb * 2**20) if args.reservoir_memory_mb is not None else None
+    outfiles = dict()
+    for sink in sinks:
+        if isinstance(sink, CountSink) and sink.store is not None:
+            outfiles[sink.name] = sink.store
+        elif snapshot is not None:
+            outfiles[sink.name] = snapshot['outfiles'][sink.name]
+        elif args.output is not None:
+            outfiles[sink.name] = os.path.join(args.output, assemble_outfile_name(args, month_name, sink.file_prefix, sink.file_ending))
+        else:
+            outfiles[sink.name] = None
+        if isinstance(sink, BaselineSink):
+            sink.spill_to(outfiles[sink.name] + ".spill", cap)
+        if snapshot is not None:
+            sink.restore(snapshot['state'][sink.name])
+    if snapshot is not None and 'stats' in snapshot:
+        stats.restore(snapshot['stats'])
+        outfiles['stats'] = snapshot['outfiles'].get('stats')
+    elif args.output is not None:
+        outfiles['stats'] = os.path.join(args.output, assemble_outfile_name(args, month_name, STATS_FILE_PREFIX, STATS_FILE_ENDING))
+
+    budget = None
+    if args.bounded_scan is not None:
+        budget = ScanBudget(args.bounded_scan, args.min_fraction, os.path.getsize(infile))
+        for sink in sinks:
+            budget.track(sink.name, sink.reservoirs)
+        if snapshot is not None:
+            budget.restore(snapshot['budget'])
+
+    started = time.perf_counter()
+    position = {'decompressed_offset': start_offset, 'compressed_offset': 0 if snapshot is None else snapshot['compressed_offset']}
+    progress_log = ProgressLog(month_name, os.path.getsize(infile), args.progress_interval,
+                               position['compressed_offset'], start_offset, stats.counters['lines'])
+
+    def progress(decompressed_offset: int, compressed_offset: int) -> bool:
+        position.update(decompressed_offset=decompressed_offset, compressed_offset=compressed_offset)
+        if checkpoint is not None and checkpoint.due():
+            start = time.perf_counter()
+            # the stats of a resumed month include the time spent on it before
+            stats_state = stats.state()
+            stats_state['seconds']['total'] = stats_state['seconds'].get('total', 0) + start - started
+            checkpoint.save({'outfiles': outfiles, 'decompressed_offset': decompressed_offset, 'compressed_offset': compressed_offset,
+                             'state': {sink.name: sink.state() for sink in sinks}, 'budget': None if budget is None else budget.state(),
+                             'stats': stats_state})
+            stats.time('checkpoint', start)
+            logging.info(f"Saved a checkpoint at {compressed_offset:,} bytes into {infile}")
+        if progress_log.due():
+            logging.info(progress_log.line(compressed_offset, decompressed_offset, stats.counters['lines']))
+        return budget is not None and budget.update(compressed_offset)
+
+    active = [sink for sink in sinks if not sink.is_idle()]
+    if active:
+        # the sinks keep their subs in order for the output, the filters test every decoded comment against them
+        filters = [(frozenset(sink.subs), sink.baseline_nr) for sink in active]
+        for comment, matches in relevant_comments(infile, args, filters, start_offset, progress, stats):
+            for i in matches:
+                if active[i].add(comment):
+                    stats.counters['replacements'] += 1
+    else:
+        logging.info("Nobody declared pronouns in this month, skipping its data")
+
+    start = time.perf_counter()
+    for sink in sinks:
+        sink.write(outfiles[sink.name])
+    stats.time('write', start)
+    stats.time('total', started)
+
+    if budget is not None:
+        budget.finish()
+        if budget.stopped_early:
+            logging.info(f"Stopped after {budget.fraction:.1%} of the month, with every reservoir at {args.bounded_scan}*K comments or more")
+        for sink in sinks:
+            if outfiles[sink.name] is not None:
+                budget.write_report(sink.name, outfiles[sink.name][:-len(sink.file_ending)] + ".budget.json")
+
+    if stats.flair_matcher is not None:
+        logging.info("Flair matcher: " + describe_stats(stats.flair_matcher))
+
+    rss = peak_rss_mb()
+    report = stats.report([sink.name for sink in active], {
+        'month': month_name, 'file_size': progress_log.file_size, **position,
+        'flair_matcher': stats.flair_matcher,
+        'peak_rss_mb': rss,
+        'spill': {sink.name: sink.spill.describe() for sink in sinks if getattr(sink, 'spill', None) is not None}})
+    logging.info("Stats: " + stats.describe())
+    if rss is not None:
+        logging.info(f"Peak RSS so far: {rss['self']:.0f} MiB in this process, {rss['children']:.0f} MiB in its largest finished child process")
+    for sink in sinks:
+        if getattr(sink, 'spill', None) is not None and sink.spill.spilled:
+            logging.info(f"{sink.name}: spilled {sink.spill.spilled:,} comments ({sink.spill.size / 2**20:.1f} MiB) to reach the reservoir memory cap")
+    if outfiles.get('stats') is not None:
+        with open(outfiles['stats'], "w", encoding="utf-8") as outfile:
+            json.dump(report, outfile, indent=2)
+    for sink in sinks:
+        if isinstance(sink, CountSink) and sink.store is not None:
+            store = CountStore(sink.store)
+            store.add_month(month_key(month_name), args, sink.monthly_counts, report['rejections'][sink.name], stats.counters['lines'])
+            store.close()
+            logging.info(f"Stored the counts of {month_name} in {sink.store}")
+    return outfiles
 
 
 def fetch_model(lang):
@@ -581,20 +1197,89 @@ def fetch_model(lang):
         exit()
 
 
+def run_month(month: str, args: argparse.Namespace) -> dict:
+    """
+    Process a single month into its own output files and return the files' paths by sink name.
+    A month that was interrupted in an earlier run with the same parameters is resumed from its last checkpoint,
+    unless --restart is given. Without an output directory there are no checkpoints.
+    """
+    if args.output is None:
+        return process_month(month, args)
+    checkpoint = MonthCheckpoint(args.output, args, month)
+    snapshot = None if args.restart else checkpoint.load()
+    if snapshot is not None:
+        logging.info(f"Resuming {month} from a checkpoint at {snapshot['compressed_offset']:,} bytes into the dump")
+    outfiles = process_month(month, args, checkpoint, snapshot)
+    checkpoint.remove()
+    return outfiles
+
+
+def configure_resources(args: argparse.Namespace):
+    """Point the resources to the files given on the command line. Nothing is loaded until first used."""
+    global resources
+    configured = Resources(args.pronouns_dir, args.userlist, args.declarers, None if args.no_cache else args.cache_dir, args.userlist_backend)
+    # keep data that is already loaded, eg. in worker processes forked from the main process
+    if configured.sources() != resources.sources():
+        resources = configured
+
+
+def init_worker(args: argparse.Namespace):
+    """
+    Set up a worker process of the month pool.
+    The worker gets the same logging, decoding, and resource setup as the main process,
+    and loads the declarer and userlist state once, before its first month.
+    """
+    logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+    decoding.use_backend(args.json_backend)
+    configure_resources(args)
+    resources.load()
+
+
 def main():
     logging.basicConfig(level=logging.NOTSET, format='INFO: %(message)s')
+    if sys.argv[1:2] == ['index']:
+        return index_main(sys.argv[2:])
+    if sys.argv[1:2] == ['userlist']:
+        return userlist_main(sys.argv[2:])
+    if sys.argv[1:2] == ['counts']:
+        return counts_main(sys.argv[2:])
     args = handle_args()
+    configure_resources(args)
     timeframe = establish_timeframe(args.time_from, args.time_to, args.input, args.reverse_order)
     logging.info(f"Establishing baseline for each month from {timeframe[0]} to {timeframe[-1]}")
 
-    # Writing the CSV headers
-    for month in timeframe:
-        outfile = assemble_outfile_name(args, month)
-        outfile = os.path.join(args.output, outfile)
-        if not args.return_all:
-            write_csv_headers(outfile)
-        process_month(month, args, outfile)
-    
+    if not args.restart and args.output is not None:
+        finished = finished_months(args.output, args)
+        for month in timeframe:
+            if month in finished:
+                logging.info(f"Skipping {month}, it was already finished with the same parameters in {', '.join(finished[month].values())}")
+        timeframe = [month for month in timeframe if month not in finished]
+    if not args.restart and args.count_store is not None and not args.baseline_nr:
+        store = CountStore(args.count_store)
+        counted = store.stored_months(args)
+        store.close()
+        for month in timeframe:
+            if month_key(month) in counted:
+                logging.info(f"Skipping {month}, it was already counted with the same parameters into {args.count_store}")
+        timeframe = [month for month in timeframe if month_key(month) not in counted]
+
+    if args.workers == 1:
+        for month in timeframe:
+            outfiles = run_month(month, args)
+            if args.output is not None:
+                record_month(args.output, args, month, outfiles)
+    else:
+        logging.info(f"Processing months with {args.workers} worker processes")
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args,)) as pool:
+            futures = {pool.submit(run_month, month, args): month for month in timeframe}
+            for future in as_completed(futures):
+                outfiles = future.result()
+                if args.output is not None:
+                    record_month(args.output, args, futures[future], outfiles)
+                    logging.info(f"Finished {futures[future]}, results written to {', '.join(outfiles.values())}")
+                else:
+                    logging.info(f"Finished {futures[future]}")
+
 
 
 if __name__ == "__main__":
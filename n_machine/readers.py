@@ -0,0 +1,294 @@
+'''
+Reading the Pushshift data dumps line by line.
+
+Dumps can be plain or compressed with zstd, xz, bz2 or gzip. Whatever the codec, the decompressed stream goes
+through the same LineReader, which splits it on the raw bytes and hands lines out undecoded,
+since all JSON decoders used by n_machine accept bytes directly.
+
+Optionally, a PrefetchStream reads and decompresses ahead in a background thread while the lines read so far are parsed.
+The zstandard, lzma, bz2, and zlib modules all release the GIL while they decompress, as does reading from a file or pipe,
+so reading the dump overlaps with the Python code that works on its lines. The thread hints the kernel to read the file ahead as well.
+'''
+
+import os
+import bz2
+import gzip
+import lzma
+import queue
+import shutil
+import threading
+import subprocess
+from contextlib import contextmanager
+
+from zstandard import ZstdDecompressor
+
+
+DEFAULT_CHUNK_SIZE = 2**27 # 128 MiB
+SPLIT_WINDOW = 2**20
+PREFETCH_CHUNK_SIZE = 2**24 # 16 MiB
+READAHEAD = 2**26 # 64 MiB of the compressed file
+
+
+class LineReader:
+    """
+    Iterate over the lines of a binary stream as bytes objects, without their line breaks.
+    The stream is read into a single reusable buffer. Only the partial line at the end of a chunk is carried over
+    to the next read, and the buffer only grows if a single line does not fit into it.
+
+    Two offsets are kept up to date for progress reports and resuming:
+    decompressed_offset is the position in the stream right after the last line handed out,
+    compressed_offset the position in the underlying file after the last read from it.
+    To resume, reading can start at a decompressed offset that was reported earlier.
+    """
+
+    def __init__(self, stream, file_handle=None, chunk_size: int = DEFAULT_CHUNK_SIZE, start_offset: int = 0):
+        self.stream = stream
+        self.file_handle = stream if file_handle is None else file_handle
+        self.chunk_size = chunk_size
+        self.start_offset = start_offset
+        self.decompressed_offset = start_offset
+        self.compressed_offset = 0
+
+    def skip_to_start(self, view: memoryview):
+        """
+        Move the stream to the start offset.
+        Plain files are seeked, compressed streams have to be decompressed up to it, but no lines are split or parsed.
+        """
+        if self.stream is self.file_handle and self.stream.seekable():
+            self.stream.seek(self.start_offset)
+            return
+        remaining = self.start_offset
+        while remaining:
+            read = self.stream.readinto(view[:min(remaining, len(view))])
+            if not read:
+                raise EOFError(f"The stream ended before the start offset {self.start_offset:,}")
+            remaining -= read
+
+    def __iter__(self):
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+        tail = 0 # length of the partial line at the start of the buffer
+        try:
+            if self.start_offset:
+                self.skip_to_start(view)
+            while True:
+                read = self.stream.readinto(view[tail:])
+                self.compressed_offset = self.file_handle.tell()
+                if not read:
+                    if tail:
+                        self.decompressed_offset += tail
+                        yield bytes(view[:tail])
+                    break
+
+                end = tail + read
+                start = 0
+                last = buffer.rfind(b"\n", 0, end)
+                while start <= last:
+                    # split the complete lines in windows, which is much faster than finding each line break
+                    # from Python while keeping the intermediate lists small
+                    stop = buffer.rfind(b"\n", start, min(start + SPLIT_WINDOW, last) + 1)
+                    if stop < start:
+                        stop = buffer.find(b"\n", start + SPLIT_WINDOW, last + 1)
+                    for line in view[start:stop].tobytes().split(b"\n"):
+                        self.decompressed_offset += len(line) + 1
+                        if line:
+                            yield line
+                    start = stop + 1
+
+                tail = end - start
+                if tail == len(buffer):
+                    # a single line fills the whole buffer
+                    view.release()
+                    buffer.extend(bytes(len(buffer)))
+                    view = memoryview(buffer)
+                elif tail:
+                    buffer[:tail] = buffer[start:end]
+        finally:
+            view.release()
+
+
+def advise(file_handle, offset: int, length: int, advice: str):
+    """Pass an access pattern hint for part of a file to the kernel, where posix_fadvise is available. Hints are only hints, so failures are ignored."""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(file_handle.fileno(), offset, length, getattr(os, f"POSIX_FADV_{advice}"))
+    except (OSError, ValueError, AttributeError):
+        pass
+
+
+class PrefetchStream:
+    """
+    A binary stream that reads ahead of its reader, with the interface LineReader uses.
+    A background thread reads the underlying stream in chunks into a queue of the given depth, and blocks while the queue is full,
+    so no more than depth chunks are held in memory at a time. Before each read, it hints the kernel to read ahead in the file.
+    tell() gives the position in the file right after the chunk that is currently handed out, not the one the thread is at.
+    """
+
+    def __init__(self, stream, file_handle, depth: int, chunk_size: int = PREFETCH_CHUNK_SIZE):
+        self.stream = stream
+        self.file_handle = file_handle
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.chunk = memoryview(b"")
+        self.offset = 0
+        self.done = False
+
+    def seekable(self) -> bool:
+        """Plain files can be seeked in until the thread starts reading them."""
+        return self.thread is None and self.stream is self.file_handle and self.stream.seekable()
+
+    def seek(self, offset: int):
+        self.stream.seek(offset)
+
+    def tell(self) -> int:
+        return self.offset
+
+    def put(self, item):
+        """Put an item into the queue, waiting for room unless reading was stopped."""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def read_ahead(self):
+        try:
+            advise(self.file_handle, 0, 0, 'SEQUENTIAL')
+            while not self.stopped.is_set():
+                advise(self.file_handle, self.file_handle.tell(), READAHEAD, 'WILLNEED')
+                chunk = self.stream.read(self.chunk_size)
+                self.put((chunk, self.file_handle.tell()))
+                if not chunk:
+                    break
+        except BaseException as e:
+            self.put((e, None))
+
+    def readinto(self, view) -> int:
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.read_ahead, name="prefetch", daemon=True)
+            self.thread.start()
+        while not self.chunk:
+            if self.done:
+                return 0
+            chunk, offset = self.queue.get()
+            if isinstance(chunk, BaseException):
+                raise chunk
+            self.done = not chunk
+            self.chunk, self.offset = memoryview(chunk), offset
+        read = min(len(view), len(self.chunk))
+        view[:read] = self.chunk[:read]
+        self.chunk = self.chunk[read:]
+        return read
+
+    def close(self):
+        """Stop the thread, which must be done before the underlying stream is closed."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def open_zst(file_handle):
+    """Return a decompressing reader over an open .zst file, reading across all of its frames."""
+    return ZstdDecompressor(max_window_size=2**31).stream_reader(file_handle, read_across_frames=True)
+
+
+# decompressing readers per file ending, each opened over the binary file handle of a dump
+# older files in the dataset are uncompressed, newer ones are compressed with one of the codecs
+CODECS = {
+    '.zst': open_zst,
+    '.xz': lzma.open,
+    '.bz2': bz2.open,
+    '.gz': gzip.open,
+    '': None,
+}
+
+# external tools that decompress with several threads, for codecs where one is commonly available
+# zstd itself is left out since its decompression is single-threaded, in the library as well as in the CLI
+THREADED_COMMANDS = {
+    '.xz': ['xz', '--decompress', '--stdout', '--threads={threads}'],
+    '.bz2': ['lbzip2', '--decompress', '--stdout', '-n', '{threads}'],
+    '.gz': ['pigz', '--decompress', '--stdout', '--processes', '{threads}'],
+}
+
+
+def file_ending(file: str) -> str:
+    """Return the codec ending of a data dump file name, or an empty string for plain files."""
+    ending = os.path.splitext(file)[1]
+    return ending if ending in CODECS else ''
+
+
+def strip_ending(file: str) -> str:
+    """Remove the codec ending from a data dump file name."""
+    ending = file_ending(file)
+    return file[:-len(ending)] if ending else file
+
+
+def threaded_command(ending: str, threads: int):
+    """Return the command line to decompress a codec with several threads, or None if there is no tool for it."""
+    command = THREADED_COMMANDS.get(ending)
+    if threads <= 1 or command is None or shutil.which(command[0]) is None:
+        return None
+    return [part.format(threads=threads) for part in command]
+
+
+@contextmanager
+def line_reader(stream, file_handle, chunk_size: int, start_offset: int, prefetch: int):
+    """Open a LineReader over a stream, prefetching up to the given number of chunks in a background thread."""
+    if not prefetch:
+        yield LineReader(stream, file_handle, chunk_size, start_offset)
+        return
+    stream = PrefetchStream(stream, stream if file_handle is None else file_handle, prefetch, min(chunk_size, PREFETCH_CHUNK_SIZE))
+    try:
+        yield LineReader(stream, chunk_size=chunk_size, start_offset=start_offset)
+    finally:
+        stream.close()
+
+
+@contextmanager
+def open_lines(file: str, chunk_size: int = DEFAULT_CHUNK_SIZE, threads: int = 1, start_offset: int = 0, prefetch: int = 0):
+    """
+    Open a data dump of any of the supported codecs for reading, as a LineReader.
+    With more than one thread, decompression is handed to an external tool if one is installed for the codec.
+    The tool reads from the same open file, so the compressed offset stays available.
+    Reading starts at the given decompressed offset, which must be the end of a line reported by an earlier LineReader.
+    With prefetch, up to that many chunks of the decompressed stream are read ahead in a background thread.
+    """
+    ending = file_ending(file)
+    with open(file, 'rb') as file_handle:
+        command = threaded_command(ending, threads)
+        if command is not None:
+            process = subprocess.Popen(command, stdin=file_handle, stdout=subprocess.PIPE)
+            try:
+                with line_reader(process.stdout, file_handle, chunk_size, start_offset, prefetch) as lines:
+                    yield lines
+            finally:
+                process.stdout.close()
+                if process.wait() not in (0, -13): # killed by SIGPIPE when we stop reading early
+                    raise OSError(f"{command[0]} failed to decompress {file}")
+        elif CODECS[ending] is None:
+            with line_reader(file_handle, None, chunk_size, start_offset, prefetch) as lines:
+                yield lines
+        else:
+            with CODECS[ending](file_handle) as stream:
+                with line_reader(stream, file_handle, chunk_size, start_offset, prefetch) as lines:
+                    yield lines
+
+
+def read_lines_zst(file_name: str, chunk_size: int = DEFAULT_CHUNK_SIZE, prefetch: int = 0):
+    """Iterate over the lines of a .zst file, yielding each as bytes together with the compressed offset read so far."""
+    with open_lines(file_name, chunk_size, prefetch=prefetch) as lines:
+        for line in lines:
+            yield line, lines.compressed_offset
+
+
+def read_raw_lines(file: str, chunk_size: int = DEFAULT_CHUNK_SIZE, threads: int = 1, prefetch: int = 0):
+    """
+    Iterate over the pushshift JSON lines, yielding them undecoded.
+    Decompress iteratively if necessary.
+    """
+    with open_lines(file, chunk_size, threads, prefetch=prefetch) as lines:
+        yield from lines
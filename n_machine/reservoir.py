@@ -0,0 +1,133 @@
+'''
+Reservoir sampling for the baselines.
+
+Baseline 1 keeps one reservoir per subreddit, baseline 2 a single one for all comments,
+both with the same Reservoir class.
+
+Every reservoir draws from its own random stream, derived from the --seed and the reservoir's month
+and subreddit in the manner of numpy's SeedSequence.spawn. A sample therefore only depends on the seed
+and the data, not on the order the months are processed in, how many workers there are,
+or whether a month was resumed from a checkpoint. The same holds for the --sample gate, which hashes comment ids.
+'''
+
+import math
+import hashlib
+
+import numpy as np
+
+
+DEFAULT_SEED = 0
+MAX_BATCH = 4096
+
+
+def subreddit_key(subreddit: str) -> int:
+    """Turn a subreddit name into a stable 64 bit integer for the spawn key of its stream."""
+    return int.from_bytes(hashlib.blake2b(subreddit.encode(), digest_size=8).digest(), 'little')
+
+
+def bernoulli_sample(key: str, seed: int, fraction: float) -> bool:
+    """
+    Decide whether an item is in a Bernoulli sample of the given fraction, by hashing its key together with the seed.
+    The decision only depends on the seed and the key, eg. a comment's id, so it needs no state to be shared
+    between processes or kept in checkpoints.
+    """
+    digest = hashlib.blake2b(key.encode(), digest_size=8, salt=(seed % 2**128).to_bytes(16, 'little')).digest()
+    return int.from_bytes(digest, 'little') < fraction * 2**64
+
+
+class RandomStream:
+    """
+    A random generator for one reservoir, drawing its numbers from numpy in batches.
+    The batch size starts small and doubles with use, so the thousands of reservoirs that only ever need
+    a handful of draws stay cheap, while busy ones rarely go back to numpy.
+    """
+
+    def __init__(self, seed: int, year: int, month: int, subreddit: str = None):
+        spawn_key = (year, month) if subreddit is None else (year, month, subreddit_key(subreddit))
+        self.generator = np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=spawn_key)))
+        self.batch = []
+        self.batch_size = 8
+
+    def random(self) -> float:
+        """Return the next float from the half-open interval [0, 1)."""
+        if not self.batch:
+            # reversed so that numbers come out in the order numpy drew them
+            self.batch = self.generator.random(self.batch_size)[::-1].tolist()
+            self.batch_size = min(2 * self.batch_size, MAX_BATCH)
+        return self.batch.pop()
+
+    def randrange(self, n: int) -> int:
+        """Return a random integer from range(n), scaled from the next float."""
+        return min(int(self.random() * n), n - 1)
+
+
+class Reservoir:
+    """
+    Uniform random sample of up to k items from a stream of unknown length.
+    Uses Li's Algorithm L: once the reservoir is full, the number of items to skip until the next replacement
+    is drawn from a geometric distribution, so only the replaced items cost random draws.
+    """
+
+    def __init__(self, k: int, rng: RandomStream):
+        self.k = k
+        self.n = 0 # number of items seen so far, including those that were skipped
+        self.items = []
+        self.rng = rng
+        self.w = None
+        self.next = None # the count n at which the next item gets sampled
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def uniform(self) -> float:
+        """Draw from the open interval (0, 1) so the logarithms below are always defined."""
+        u = self.rng.random()
+        while u == 0.0:
+            u = self.rng.random()
+        return u
+
+    def advance(self):
+        """Draw the next replacement weight and the position of the next sampled item."""
+        self.w *= math.exp(math.log(self.uniform()) / self.k)
+        skip = math.floor(math.log(self.uniform()) / math.log1p(-self.w)) if self.w < 1.0 else 0
+        self.next = self.n + skip + 1
+
+    def consider(self):
+        """
+        Count the next item of the stream.
+        Return the slot the item goes into, or None if it is not sampled.
+        Callers can use this to only materialize the items that are actually kept.
+        """
+        self.n += 1
+        if self.k == 0:
+            return None
+        if self.n <= self.k:
+            if self.n == self.k:
+                self.w = 1.0
+                self.advance()
+            return self.n - 1
+        if self.n < self.next:
+            return None
+        slot = self.rng.randrange(self.k)
+        self.advance()
+        return slot
+
+    def place(self, slot: int, item):
+        """Put an item into the slot consider() returned, returning the item it replaced, if any."""
+        if slot == len(self.items):
+            self.items.append(item)
+            return None
+        replaced = self.items[slot]
+        self.items[slot] = item
+        return replaced
+
+    def add(self, item) -> bool:
+        """Offer an item to the reservoir, returning whether it was sampled."""
+        slot = self.consider()
+        if slot is None:
+            return False
+        self.place(slot, item)
+        return True
@@ -0,0 +1,182 @@
+'''
+The comparison data n_machine works with: the pronoun lists, the userlist, and the pronoun declarers.
+
+Nothing is loaded until it is first used, so that eg. --help doesn't pay for it.
+Everything derived from the source files is kept in a single cache bundle that is keyed by the files'
+paths and modification times, so later runs load one pickle instead of walking the pronoun lists,
+unpickling the userlist, and reading the declarers with pandas.
+'''
+
+import os
+import pickle
+import hashlib
+import logging
+from functools import cached_property
+
+from n_machine.files import write_atomically
+from n_machine.flair import FlairMatcher
+from n_machine.userlist import HashedUserlist
+
+
+DEFAULT_PRONOUNS_DIR = "~/Documents/GitHub/pronounlist/Pronouns"
+DEFAULT_USERLIST = "~/Documents/GitHub/n_machine/assets/userlist.pkl"
+DEFAULT_DECLARERS = "~/Documents/GitHub/n_machine/assets/pronoun_declarers.pkl"
+DEFAULT_CACHE_DIR = "~/.cache/n_machine"
+USERLIST_BACKENDS = ['set', 'hashed']
+
+
+def pronoun_files(pronouns_dir: str) -> list:
+    """Return the paths of all pronoun list files, in a stable order."""
+    paths = list()
+    for root, dirs, files in os.walk(pronouns_dir):
+        for file in files:
+            if not file.startswith('.'):
+                paths.append(os.path.join(root, file))
+    return sorted(paths)
+
+
+def read_pronouns(pronouns_dir: str) -> list:
+    """Read and dedupe all pronouns from the pronoun lists."""
+    pronouns = set()
+    for filepath in pronoun_files(pronouns_dir):
+        with open(filepath) as infile:
+            pronouns.update(infile.read().split('\n'))
+    # note that trailing newlines in the lists leave an empty string in here, which makes the list part
+    # of the flair regex match any "word/word" flair
+    return sorted(pronouns)
+
+
+def build_k_index(data) -> dict:
+    """Count the declarers of every subreddit in every month, as {(year, month): {subreddit: k}}."""
+    k_index = dict()
+    for (year, month, subreddit), k in data.groupby(['year', 'month', 'subreddit'], observed=True).size().items():
+        k_index.setdefault((int(year), int(month)), {})[subreddit] = int(k)
+    return k_index
+
+
+def load_k_index(declarers_path: str, data) -> dict:
+    """
+    Load the K index that is kept next to the declarers file.
+    It is rebuilt whenever it is missing or older than the declarers file.
+    """
+    index_path = os.path.splitext(declarers_path)[0] + "_k_index.pkl"
+    if os.path.isfile(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(declarers_path):
+        with open(index_path, "rb") as infile:
+            return pickle.load(infile)
+
+    k_index = build_k_index(data)
+    try:
+        with write_atomically(index_path) as outfile:
+            pickle.dump(k_index, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        logging.warning(f"Could not save the K index to {index_path}, it will be rebuilt on the next run.")
+    return k_index
+
+
+class Resources:
+    """
+    Lazily loaded comparison data.
+    The pronouns, userlist, K index, and subs all come from the cache bundle if it is up to date,
+    and are otherwise read from the source files, after which the bundle is rewritten.
+    With the hashed userlist backend, the userlist is memory-mapped from its converted hash table instead.
+    """
+
+    def __init__(self, pronouns_dir: str = DEFAULT_PRONOUNS_DIR, userlist_path: str = DEFAULT_USERLIST,
+                 declarers_path: str = DEFAULT_DECLARERS, cache_dir: str = DEFAULT_CACHE_DIR, userlist_backend: str = 'set'):
+        self.pronouns_dir = os.path.expanduser(pronouns_dir)
+        self.userlist_path = os.path.expanduser(userlist_path)
+        self.declarers_path = os.path.expanduser(declarers_path)
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir is not None else None
+        self.userlist_backend = userlist_backend
+        self.flair_matchers = dict()
+
+    def sources(self) -> tuple:
+        """The files and cache directory these resources are loaded from."""
+        return self.pronouns_dir, self.userlist_path, self.declarers_path, self.cache_dir, self.userlist_backend
+
+    def source_key(self) -> tuple:
+        """Identify the current state of all source files by their paths, sizes, and modification times."""
+        key = list()
+        for path in pronoun_files(self.pronouns_dir) + [self.userlist_path, self.declarers_path]:
+            stat = os.stat(path)
+            key.append((path, stat.st_size, stat.st_mtime_ns))
+        return tuple(key)
+
+    @cached_property
+    def bundle_path(self):
+        """The cache bundle of this combination of source files, or None if caching is disabled."""
+        if self.cache_dir is None:
+            return None
+        name = hashlib.sha1(f"{self.pronouns_dir}|{self.userlist_path}|{self.declarers_path}".encode()).hexdigest()[:12]
+        if self.userlist_backend != 'set':
+            name += f"-{self.userlist_backend}"
+        return os.path.join(self.cache_dir, f"resources-{name}.pkl")
+
+    @cached_property
+    def bundle(self) -> dict:
+        """Load the cache bundle, building it from the source files if it is missing or out of date."""
+        key = self.source_key()
+        if self.bundle_path is not None and os.path.isfile(self.bundle_path):
+            with open(self.bundle_path, "rb") as infile:
+                bundle = pickle.load(infile)
+            if bundle['key'] == key:
+                return bundle
+
+        logging.info("Loading the pronoun lists, userlist, and pronoun declarers")
+        import pandas as pd # only needed to build the bundle, and slow to import
+        declarers = pd.read_pickle(self.declarers_path)
+        userlist = None
+        if self.userlist_backend == 'set':
+            with open(self.userlist_path, "rb") as infile:
+                userlist = set(pickle.load(infile))
+        bundle = {'key': key,
+                  'pronouns': read_pronouns(self.pronouns_dir),
+                  'userlist': userlist,
+                  'k_index': load_k_index(self.declarers_path, declarers),
+                  'subs': declarers['subreddit'].unique().tolist()}
+
+        if self.bundle_path is not None:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with write_atomically(self.bundle_path) as outfile:
+                    pickle.dump(bundle, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+            except OSError:
+                logging.warning(f"Could not save the resource cache to {self.bundle_path}")
+        return bundle
+
+    @property
+    def pronouns(self) -> list:
+        return self.bundle['pronouns']
+
+    @property
+    def userlist(self):
+        """The authors to exclude, as a set or as a HashedUserlist, which both support `author in userlist`."""
+        if self.userlist_backend == 'hashed':
+            return self.hashed_userlist
+        return self.bundle['userlist']
+
+    @cached_property
+    def hashed_userlist(self) -> HashedUserlist:
+        return HashedUserlist(self.userlist_path)
+
+    @property
+    def k_index(self) -> dict:
+        return self.bundle['k_index']
+
+    @property
+    def subs(self) -> list:
+        """All subreddits the declarers posted in, in the order of the declarers data."""
+        return self.bundle['subs']
+
+    def flair_matcher(self, case_sensitive: bool) -> FlairMatcher:
+        """Return the flair matcher for a setting of --case-sensitive, compiling it on first use."""
+        if case_sensitive not in self.flair_matchers:
+            self.flair_matchers[case_sensitive] = FlairMatcher(self.pronouns, case_sensitive)
+        return self.flair_matchers[case_sensitive]
+
+    def load(self):
+        """Load everything up front, eg. once per worker process before its first task."""
+        if self.userlist_backend == 'hashed':
+            self.hashed_userlist
+        return self.bundle
+
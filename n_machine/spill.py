@@ -0,0 +1,144 @@
+'''
+Bounded memory for the reservoirs of a month.
+
+The reservoirs of baseline 1 hold up to K comments for every subreddit of the declarers, and baseline 2 holds 2*K overall,
+all until the month is written out. With --reservoir_memory_mb, the estimated size of the comments they hold is capped.
+Once a month's reservoirs reach the cap, the comments they hold are encoded back into JSON lines and appended to a spill file
+next to the output file, and only their offsets and lengths stay in memory. From then on every sampled comment goes to the spill file.
+When the month is written, the spilled comments are read back and decoded one by one, and the spill file is deleted.
+
+Comments that get replaced in a reservoir stay in the spill file as dead bytes. With Algorithm L a reservoir of k comments
+only replaces some k*ln(n/k) comments over a stream of n, so the file grows to a few times the size of the sample at most.
+The spill file is flushed with every checkpoint, and truncated back to the checkpointed size when a month resumes.
+'''
+
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from n_machine.decoding import COMMENT_FIELDS, encode_comment
+
+
+def comment_size(comment) -> int:
+    """Estimate the memory a comment takes, as the shallow size of the comment and of its values."""
+    values = comment.values() if isinstance(comment, dict) else (getattr(comment, field) for field in COMMENT_FIELDS)
+    return sys.getsizeof(comment) + sum(sys.getsizeof(value) for value in values)
+
+
+def peak_rss_mb() -> dict:
+    """Return the peak resident set size of this process and of its finished child processes, in MiB, or None where it is not available."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 2**10
+    return {who: resource.getrusage(flag).ru_maxrss * unit / 2**20
+            for who, flag in (('self', resource.RUSAGE_SELF), ('children', resource.RUSAGE_CHILDREN))}
+
+
+class MemoryCap:
+    """The estimated size of the comments all reservoirs of a month hold in memory, against a cap in bytes."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+    def exceeded(self) -> bool:
+        return self.used > self.limit
+
+
+class Spilled:
+    """A comment in a spill file, by its offset and length."""
+    __slots__ = ('offset', 'length')
+
+    def __init__(self, offset: int, length: int):
+        self.offset = offset
+        self.length = length
+
+
+class SpillFile:
+    """
+    The comments a sink's reservoirs hold, in memory until the month's memory cap is reached and in an append-only file after.
+    keep() returns what a reservoir should hold for a sampled comment, release() accounts for one it replaced.
+    """
+
+    def __init__(self, path: str, cap: MemoryCap):
+        self.path = path
+        self.cap = cap
+        self.file = None
+        self.size = 0 # bytes written to the file, including dead ones
+        self.dead = 0 # bytes of comments that were replaced since they were spilled
+        self.spilled = 0 # number of comments spilled
+
+    @property
+    def spilling(self) -> bool:
+        return self.file is not None
+
+    def start(self, reservoirs: dict):
+        """Open the spill file and move every comment the reservoirs hold in memory into it."""
+        self.file = open(self.path, "w+b")
+        for reservoir in reservoirs.values():
+            for slot, comment in enumerate(reservoir.items):
+                if not isinstance(comment, Spilled):
+                    self.cap.used -= comment_size(comment)
+                    reservoir.items[slot] = self.write(comment)
+
+    def write(self, comment) -> Spilled:
+        data = encode_comment(comment)
+        spilled = Spilled(self.size, len(data))
+        self.file.write(data)
+        self.size += len(data)
+        self.spilled += 1
+        return spilled
+
+    def keep(self, comment, reservoirs: dict):
+        """Return what to put into a reservoir for a sampled comment: the comment itself, or its place in the spill file."""
+        if not self.spilling:
+            self.cap.used += comment_size(comment)
+            if not self.cap.exceeded():
+                return comment
+            self.cap.used -= comment_size(comment)
+            self.start(reservoirs)
+        return self.write(comment)
+
+    def release(self, item):
+        """Account for an item that was replaced in a reservoir."""
+        if isinstance(item, Spilled):
+            self.dead += item.length
+        else:
+            self.cap.used -= comment_size(item)
+
+    def read(self, item, decode):
+        """Return a comment a reservoir holds, reading and decoding it from the spill file if it was spilled. Only once nothing more is spilled."""
+        if not isinstance(item, Spilled):
+            return item
+        self.file.seek(item.offset)
+        return decode(self.file.read(item.length))
+
+    def state(self) -> dict:
+        if self.spilling:
+            self.file.flush()
+        return {'spilling': self.spilling, 'size': self.size, 'dead': self.dead, 'spilled': self.spilled}
+
+    def restore(self, state: dict, reservoirs: dict):
+        """Continue from a checkpoint, dropping what was spilled after it, and recount the comments held in memory."""
+        if state['spilling']:
+            self.file = open(self.path, "r+b")
+            self.file.truncate(state['size'])
+            self.file.seek(state['size'])
+        self.size, self.dead, self.spilled = state['size'], state['dead'], state['spilled']
+        for reservoir in reservoirs.values():
+            self.cap.used += sum(comment_size(comment) for comment in reservoir.items if not isinstance(comment, Spilled))
+
+    def close(self):
+        """Close and delete the spill file once the month is written."""
+        if self.spilling:
+            self.file.close()
+            self.file = None
+            os.remove(self.path)
+
+    def describe(self) -> dict:
+        return {'spilled': self.spilled, 'spill_bytes': self.size, 'dead_bytes': self.dead}
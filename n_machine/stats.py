@@ -0,0 +1,106 @@
+'''
+Instrumentation of the pass over a month's dump.
+
+Counters and timers are kept per stage: reading (decompressing and splitting the dump into lines), the byte-level prefilter,
+decoding, the tests of relevant(), and writing the output files. Rejections are counted per filter by the reason relevant()
+gives, ie. the first of its tests a comment fails. Lines the prefilter rejects are counted under the test that rejected them.
+
+Timers are only ever started and stopped around whole blocks of lines, so they cost next to nothing.
+With decode workers, the stages that run in the workers add up the time of all workers.
+'''
+
+import time
+from collections import Counter
+from datetime import timedelta
+
+
+REASONS = ['subreddit', 'toplevel', 'sample', 'score', 'bot', 'flair', 'userlist', 'regex']
+
+STATS_FILE_PREFIX = "stats_from-month_"
+STATS_FILE_ENDING = ".stats.json"
+
+
+class Stats:
+    """Counters, timers, and rejection reasons of one month, which can be added up across decode worker processes."""
+
+    def __init__(self):
+        self.counters = Counter()
+        self.seconds = Counter()
+        # the per-filter rejection reasons of every line, or None for each filter the line is relevant to
+        self.rejections = Counter()
+        # relevant comments per subreddit
+        self.subreddits = Counter()
+        # the flair matcher's cache hits and misses and time spent matching, once the month's dump is read
+        self.flair_matcher = None
+
+    def time(self, stage: str, start: float) -> float:
+        """Add the time since start to a stage, and return the current time to start the next stage from."""
+        now = time.perf_counter()
+        self.seconds[stage] += now - start
+        return now
+
+    def state(self) -> dict:
+        return {'counters': dict(self.counters), 'seconds': dict(self.seconds),
+                'rejections': dict(self.rejections), 'subreddits': dict(self.subreddits)}
+
+    def add(self, state: dict):
+        """Add the state of other stats, eg. those of a decode worker."""
+        self.counters.update(state['counters'])
+        self.seconds.update(state['seconds'])
+        self.rejections.update(state['rejections'])
+        self.subreddits.update(state['subreddits'])
+
+    def restore(self, state: dict):
+        self.__init__()
+        self.add(state)
+
+    def take(self) -> dict:
+        """Return the state and start over, keeping the same counter objects for whoever holds on to them."""
+        state = self.state()
+        for counter in (self.counters, self.seconds, self.rejections, self.subreddits):
+            counter.clear()
+        return state
+
+    def report(self, filter_names: list, extra: dict = None) -> dict:
+        """Summarize the stats, with the rejections broken down by filter and reason."""
+        rejections = {name: {reason: 0 for reason in REASONS + ['relevant']} for name in filter_names}
+        for reasons, count in self.rejections.items():
+            for name, reason in zip(filter_names, reasons):
+                rejections[name][reason or 'relevant'] += count
+        report = {'counters': dict(self.counters), 'seconds': dict(self.seconds), 'rejections': rejections,
+                  'subreddits': dict(self.subreddits.most_common())}
+        if extra:
+            report.update(extra)
+        return report
+
+    def describe(self) -> str:
+        """Summarize the counters and timers for the log."""
+        stages = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in self.seconds.most_common() if stage != 'total')
+        return (f"{self.counters['lines']:,} lines, {self.counters['decoded']:,} decoded, {self.counters['replacements']:,} reservoir replacements"
+                f" in {self.seconds['total']:.1f}s ({stages})")
+
+
+class ProgressLog:
+    """Regular progress lines for a month, with its throughput and the time left estimated from the position in the dump."""
+
+    def __init__(self, name: str, file_size: int, interval: float, compressed_offset: int = 0, decompressed_offset: int = 0, lines: int = 0):
+        self.name = name
+        self.file_size = file_size
+        self.interval = interval
+        # where the month starts off, which is not at the beginning of the dump if it is resumed
+        self.start = (compressed_offset, decompressed_offset, lines)
+        self.started = time.monotonic()
+        self.last = self.started
+
+    def due(self) -> bool:
+        return self.interval > 0 and time.monotonic() - self.last >= self.interval
+
+    def line(self, compressed_offset: int, decompressed_offset: int, lines: int) -> str:
+        """Describe how far the dump has been read, and how long the rest will take at the rate so far."""
+        self.last = time.monotonic()
+        elapsed = max(self.last - self.started, 1e-9)
+        fraction = min(compressed_offset / self.file_size, 1.0) if self.file_size else 1.0
+        rate = (compressed_offset - self.start[0]) / elapsed
+        left = timedelta(seconds=round(max(self.file_size - compressed_offset, 0) / rate)) if rate > 0 else "unknown time"
+        return (f"{self.name}: {fraction:.1%} of {self.file_size / 1e9:.2f} GB read, {(decompressed_offset - self.start[1]) / elapsed / 1e6:.1f} MB/s"
+                f" decompressed, {(lines - self.start[2]) / elapsed:,.0f} lines/s, {left} left")
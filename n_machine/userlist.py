@@ -0,0 +1,112 @@
+'''
+A compact, memory-mapped userlist.
+
+The userlist is a pickled list of author names, which relevant() tests every comment's author against.
+As a Python set it takes around a hundred bytes per author, in every process that loads it.
+Instead, the names can be converted once into a hash table: the sorted 64 bit hashes of all names in a .npy file,
+fronted by a Bloom filter in a second one. Both are memory-mapped read-only, so every process on the machine
+shares the same pages, and only the pages that lookups touch are ever read.
+
+A lookup hashes the name and tests its bits in the Bloom filter, which turns most authors that are not on the list away.
+The others are looked up in the sorted hashes with a binary search. An author who is not on the list only counts as listed
+if their name shares its 64 bit hash with a listed one, which for a million listed names happens once in some 18 trillion lookups.
+'''
+
+import os
+import math
+import pickle
+import bisect
+import hashlib
+from functools import lru_cache
+
+import numpy as np
+
+from n_machine.files import write_atomically
+
+
+HASHES_ENDING = ".hashes.npy"
+BLOOM_ENDING = ".bloom.npy"
+DEFAULT_BITS_PER_AUTHOR = 10
+CACHE_SIZE = 2**16
+
+
+def author_hash(author) -> int:
+    """Hash an author name, given as str or as the raw bytes of a line, to 64 bits."""
+    if isinstance(author, str):
+        author = author.encode()
+    return int.from_bytes(hashlib.blake2b(author, digest_size=8).digest(), 'little')
+
+
+def table_paths(userlist_path: str) -> tuple:
+    """Return the paths of the hashes and the Bloom filter converted from a userlist."""
+    stem = os.path.splitext(userlist_path)[0]
+    return stem + HASHES_ENDING, stem + BLOOM_ENDING
+
+
+def bloom_hashes(n: int, bits: int) -> int:
+    """The number of bit positions per name that minimizes false positives for n names in a filter of that many bits."""
+    return max(1, round(bits / max(n, 1) * math.log(2)))
+
+
+def convert_userlist(userlist_path: str, bits_per_author: int = DEFAULT_BITS_PER_AUTHOR) -> tuple:
+    """Convert a pickled userlist into its hash table and Bloom filter next to it. Return the number of names and table paths."""
+    with open(userlist_path, "rb") as infile:
+        names = set(pickle.load(infile))
+    hashes = np.unique(np.fromiter((author_hash(name) for name in names), dtype='<u8', count=len(names)))
+
+    n_bits = max(8, bits_per_author * len(hashes))
+    n_bits += -n_bits % 8
+    k = bloom_hashes(len(hashes), n_bits)
+    bloom = np.zeros(n_bits // 8, dtype=np.uint8)
+    # the k bit positions of each name are derived from the two halves of its hash (double hashing)
+    low, high = hashes & 0xFFFFFFFF, hashes >> np.uint64(32) | np.uint64(1)
+    for i in range(k):
+        positions = (low + np.uint64(i) * high) % np.uint64(n_bits)
+        np.bitwise_or.at(bloom, positions >> np.uint64(3), (1 << (positions & np.uint64(7))).astype(np.uint8))
+
+    hashes_path, bloom_path = table_paths(userlist_path)
+    for path, array in ((hashes_path, hashes), (bloom_path, bloom)):
+        with write_atomically(path) as outfile:
+            np.save(outfile, array)
+    return len(names), hashes_path, bloom_path
+
+
+class HashedUserlist:
+    """
+    Membership tests against a converted userlist, with the same `author in userlist` interface as a set.
+    The Bloom filter can be left out, in which case every lookup is a binary search.
+    Verdicts on the most recent authors are cached, since the same authors come up over and over again.
+    """
+
+    def __init__(self, userlist_path: str, bloom: bool = True, cache_size: int = CACHE_SIZE):
+        hashes_path, bloom_path = table_paths(userlist_path)
+        if not os.path.isfile(hashes_path) or os.path.getmtime(hashes_path) < os.path.getmtime(userlist_path):
+            raise FileNotFoundError(f"The userlist {userlist_path} has not been converted since it last changed")
+        # memoryviews of the mapped arrays index into plain ints, which is much faster than indexing numpy arrays one by one
+        self.hashes = memoryview(np.load(hashes_path, mmap_mode='r')).cast('B').cast('Q')
+        self.bits = None
+        if bloom and os.path.isfile(bloom_path):
+            self.bits = memoryview(np.load(bloom_path, mmap_mode='r')).cast('B')
+            self.n_bits = len(self.bits) * 8
+            self.k = bloom_hashes(len(self.hashes), self.n_bits)
+        self.contains = lru_cache(maxsize=cache_size)(self.lookup)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def __contains__(self, author) -> bool:
+        return self.contains(author)
+
+    def lookup(self, author) -> bool:
+        """Test an author name, bypassing the cache."""
+        hashed = author_hash(author)
+        if self.bits is not None:
+            # the same positions as in convert_userlist(), one name at a time
+            bits, n_bits = self.bits, self.n_bits
+            low, high = hashed & 0xFFFFFFFF, hashed >> 32 | 1
+            for i in range(self.k):
+                position = (low + i * high) % n_bits
+                if not bits[position >> 3] >> (position & 7) & 1:
+                    return False
+        i = bisect.bisect_left(self.hashes, hashed)
+        return i < len(self.hashes) and self.hashes[i] == hashed
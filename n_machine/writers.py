@@ -0,0 +1,175 @@
+'''
+Writing the extracted comments of a month.
+
+A writer is opened once per output file and takes rows in the layout of the CSV headers, or whole comments
+with --return_all. Rows are buffered and written out in batches, as semicolon CSV, JSON lines,
+either of them zstd-compressed, or as Parquet or Arrow IPC files with a fixed schema.
+The columnar formats need pyarrow and are only available if it is installed.
+pyarrow is slow to import, so it is only imported once one of them is asked for.
+'''
+
+import io
+import csv
+import json
+
+from zstandard import ZstdCompressor
+
+
+COLUMNS = ['text', 'span', 'subreddit', 'score', 'user', 'flairtext', 'date', 'permalink']
+
+FORMATS = ['csv', 'csv.zst', 'jsonl', 'jsonl.zst', 'parquet', 'arrow']
+COMMENT_FORMATS = ['jsonl', 'jsonl.zst'] # whole comments don't have a fixed set of columns
+
+BATCH_ROWS = 10000
+ZSTD_LEVEL = 3
+
+
+def import_pyarrow(output_format: str):
+    """Import pyarrow for a columnar output format, raising an ImportError if it is not installed."""
+    try:
+        import pyarrow as pa
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(f"--output_format {output_format} needs pyarrow, which is not installed") from None
+    return pa
+
+
+def arrow_schema(pa):
+    """The fixed schema of the columnar formats, in the layout of the CSV headers."""
+    return pa.schema([('text', pa.string()), ('span', pa.string()), ('subreddit', pa.string()), ('score', pa.int64()),
+                      ('user', pa.string()), ('flairtext', pa.string()), ('date', pa.int64()), ('permalink', pa.string())])
+
+
+def default_format(return_all: bool) -> str:
+    """The output format used if none is given: CSV, or JSON lines for whole comments."""
+    return 'jsonl' if return_all else 'csv'
+
+
+def output_ending(output_format: str) -> str:
+    """Return the file ending of an output format."""
+    return '.' + output_format
+
+
+def open_text(path: str, compressed: bool) -> io.TextIOBase:
+    """Open a text file for writing, zstd-compressing it if asked to."""
+    if not compressed:
+        return open(path, 'w', encoding='utf-8', newline='')
+    raw = open(path, 'wb')
+    return io.TextIOWrapper(ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=True), encoding='utf-8', newline='')
+
+
+class Writer:
+    """
+    Base of all writers: buffers rows and hands them to flush() in batches.
+    Writers are context managers, and anything still buffered is written when they are closed.
+    """
+
+    def __init__(self, batch_rows: int = BATCH_ROWS):
+        self.batch_rows = batch_rows
+        self.rows = []
+
+    def write_row(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+            self.rows = []
+
+    def write_comment(self, comment: dict):
+        raise ValueError(f"{type(self).__name__} can only write rows, not whole comments")
+
+    def flush(self):
+        raise NotImplementedError
+
+    def close(self):
+        if self.rows:
+            self.flush()
+            self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CsvWriter(Writer):
+    """Semicolon-separated rows below a header line, the layout n_machine has always written."""
+
+    def __init__(self, path: str, compressed: bool = False, batch_rows: int = BATCH_ROWS):
+        super().__init__(batch_rows)
+        self.outfile = open_text(path, compressed)
+        self.csvwriter = csv.writer(self.outfile, delimiter=";", quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        self.csvwriter.writerow(COLUMNS)
+
+    def flush(self):
+        self.csvwriter.writerows(self.rows)
+
+    def close(self):
+        super().close()
+        self.outfile.close()
+
+
+class JsonlWriter(Writer):
+    """One JSON object per line, either a row keyed by the column names or a whole comment."""
+
+    def __init__(self, path: str, compressed: bool = False, batch_rows: int = BATCH_ROWS):
+        super().__init__(batch_rows)
+        self.outfile = open_text(path, compressed)
+
+    def write_row(self, row):
+        super().write_row(json.dumps(dict(zip(COLUMNS, row))))
+
+    def write_comment(self, comment: dict):
+        super().write_row(json.dumps(comment))
+
+    def flush(self):
+        self.outfile.write('\n'.join(self.rows) + '\n')
+
+    def close(self):
+        super().close()
+        self.outfile.close()
+
+
+class ArrowWriter(Writer):
+    """
+    Rows in the fixed schema, written as one record batch per batch of rows,
+    either to a Parquet file or to an Arrow IPC file that can be memory-mapped when it's read back.
+    """
+
+    def __init__(self, path: str, parquet: bool = False, batch_rows: int = BATCH_ROWS):
+        self.pa = pa = import_pyarrow('parquet' if parquet else 'arrow')
+        self.schema = arrow_schema(pa)
+        super().__init__(batch_rows)
+        if parquet:
+            self.writer = pa.parquet.ParquetWriter(path, self.schema, compression='zstd')
+        else:
+            self.writer = pa.ipc.new_file(path, self.schema)
+
+    def flush(self):
+        columns = list(zip(*self.rows))
+        # dates are ints in most dumps, but strings in some of the older ones
+        columns[6] = [int(date) for date in columns[6]]
+        pa = self.pa
+        self.writer.write_batch(pa.RecordBatch.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, self.schema)], schema=self.schema))
+
+    def close(self):
+        super().close()
+        self.writer.close()
+
+
+def check_format(output_format: str):
+    """Raise an ImportError if an output format needs a library that is not installed."""
+    if output_format in ('parquet', 'arrow'):
+        import_pyarrow(output_format)
+
+
+def open_writer(path: str, output_format: str) -> Writer:
+    """Open a writer for an output file of the given format."""
+    if output_format in ('csv', 'csv.zst'):
+        return CsvWriter(path, compressed=output_format.endswith('.zst'))
+    if output_format in ('jsonl', 'jsonl.zst'):
+        return JsonlWriter(path, compressed=output_format.endswith('.zst'))
+    if output_format in ('parquet', 'arrow'):
+        return ArrowWriter(path, parquet=output_format == 'parquet')
+    raise ValueError(f"Unknown output format {output_format}")
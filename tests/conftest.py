@@ -0,0 +1,54 @@
+import os
+import sys
+import glob
+
+import pytest
+
+# the synthetic dumps and comparison data of the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from synthetic import synthetic_resources, write_month
+
+from n_machine import main as n_machine
+
+
+YEAR, MONTH = 2021, 1
+
+
+@pytest.fixture(scope="session")
+def synthetic_month(tmp_path_factory) -> str:
+    """A directory with a synthetic month of 20,000 comments, returning the path of its dump."""
+    directory = tmp_path_factory.mktemp("dumps")
+    path, _ = write_month(str(directory), 20000, 0, YEAR, MONTH)
+    return path
+
+
+@pytest.fixture
+def resources(monkeypatch):
+    """Made-up comparison data that fits the synthetic month, in place of the real files."""
+    resources = synthetic_resources(0, months=[(YEAR, MONTH)])
+    monkeypatch.setattr(n_machine, "resources", resources)
+    return resources
+
+
+@pytest.fixture
+def make_args():
+    """Return a function that parses the options of a run and completes them as handle_args() would."""
+    def make_args(input_dir: str, output_dir: str, *options: str):
+        args = n_machine.define_parser().parse_args(['--input', input_dir, '--output', output_dir, *options])
+        args.output_format = args.output_format or 'csv'
+        args.baseline_nr = sorted(set(args.baseline_nr))
+        return args
+    return make_args
+
+
+@pytest.fixture
+def outputs():
+    """Return a function that reads the output files of the baselines in a directory, by baseline."""
+    def outputs(output_dir: str) -> dict:
+        files = dict()
+        for path in glob.glob(os.path.join(output_dir, "baseline-*")):
+            with open(path, "rb") as infile:
+                files[os.path.basename(path).split("_")[0]] = infile.read()
+        return files
+    return outputs
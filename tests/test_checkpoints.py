@@ -0,0 +1,19 @@
+import pytest
+
+from n_machine.checkpoints import run_fingerprint
+
+
+@pytest.mark.parametrize("options", [['--batch_size', '1000'], ['--block_size', '500'], ['--decode_workers', '2'], ['--workers', '3'],
+                                     ['--chunk_size', '1'], ['--prefetch', '2'], ['--reservoir_memory_mb', '1'], ['--json_backend', 'json'],
+                                     ['--cache_dir', 'elsewhere'], ['--no_cache']])
+def test_execution_options_keep_fingerprint(make_args, tmp_path, options):
+    # a run can resume the checkpoints and finished months of another one that only differs in how it is executed
+    plain = make_args(str(tmp_path), str(tmp_path), '--popularity', '0')
+    assert run_fingerprint(make_args(str(tmp_path), str(tmp_path), '--popularity', '0', *options)) == run_fingerprint(plain)
+
+
+@pytest.mark.parametrize("options", [['--seed', '1'], ['--popularity', '1'], ['--baseline_nr', '2']])
+def test_result_options_change_fingerprint(make_args, tmp_path, options):
+    plain = make_args(str(tmp_path), str(tmp_path), '--popularity', '0')
+    assert run_fingerprint(make_args(str(tmp_path), str(tmp_path), '--popularity', '0', *options)) != run_fingerprint(plain)
+
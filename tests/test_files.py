@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+from n_machine.files import write_atomically
+
+
+def test_write_atomically(tmp_path):
+    path = str(tmp_path / "file")
+    with write_atomically(path) as outfile:
+        outfile.write(b"first")
+    with pytest.raises(RuntimeError):
+        with write_atomically(path) as outfile:
+            outfile.write(b"half")
+            raise RuntimeError
+    # a failed write leaves the earlier file as it was, and no temporary file
+    with open(path, "rb") as infile:
+        assert infile.read() == b"first"
+    assert os.listdir(str(tmp_path)) == ["file"]
@@ -0,0 +1,71 @@
+import re
+import random
+
+import pytest
+
+from n_machine.flair import FlairMatcher, negative_regex, trie_regex
+
+
+def old_negative_regex(pronouns) -> str:
+    """The flair regex as it was before trie_regex(), a plain alternation of the pronouns sorted by length."""
+    pronouns = sorted(set(pronouns), key=lambda x: len(x), reverse=True)
+    pronouns_bars = '|'.join(pronouns)
+    pronouns_regex = f'(?:{pronouns_bars})'
+    pronouns_regex = f'\\b{pronouns_regex}/{pronouns_regex}\\b'
+    free_pronoun_regex = '(.+)/\\2s(elf)?\\b'
+    noanyall_regex = "(no|any|all).pronouns?"
+    combined_regexes = '|'.join([pronouns_regex, free_pronoun_regex, noanyall_regex])
+    return f'(?:({combined_regexes}))'
+
+
+def random_pronouns(rng: random.Random, empty: bool) -> list:
+    """Short words over few letters, so that they share many prefixes and are prefixes of each other."""
+    pronouns = ["".join(rng.choice("aBs") for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 12))]
+    return pronouns + [""] if empty else pronouns
+
+
+def random_flair(rng: random.Random) -> str:
+    pieces = ["a", "b", "A", "B", "s", "S", "/", "/", " ", "-", "self", "no pronouns", "Any Pronoun", "all"]
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(0, 8)))
+
+
+def test_trie_regex_matches_exactly_the_words():
+    rng = random.Random(0)
+    for _ in range(300):
+        words = random_pronouns(rng, rng.random() < 0.5)
+        regex = re.compile(trie_regex(words))
+        for candidate in {"".join(rng.choice("aBs") for _ in range(rng.randint(0, 5))) for _ in range(50)} | set(words):
+            assert (regex.fullmatch(candidate) is not None) == (candidate in words), (words, candidate)
+
+
+def test_trie_regex_escapes_words():
+    assert re.fullmatch(trie_regex(["a.b", "(x)"]), "a.b")
+    assert re.fullmatch(trie_regex(["a.b", "(x)"]), "(x)")
+    assert not re.fullmatch(trie_regex(["a.b", "(x)"]), "axb")
+
+
+@pytest.mark.parametrize("case_sensitive", [True, False])
+@pytest.mark.parametrize("empty", [True, False], ids=["empty pronoun", "no empty pronoun"])
+def test_flair_regex_matches_old_regex(case_sensitive, empty):
+    rng = random.Random(int(case_sensitive) * 2 + int(empty))
+    flags = 0 if case_sensitive else re.IGNORECASE
+    for _ in range(200):
+        pronouns = random_pronouns(rng, empty)
+        new, old = re.compile(negative_regex(pronouns), flags), re.compile(old_negative_regex(pronouns), flags)
+        matcher = FlairMatcher(pronouns, case_sensitive)
+        for _ in range(50):
+            flair = random_flair(rng)
+            expected = old.search(flair) is not None
+            assert (new.search(flair) is not None) == expected, (pronouns, flair)
+            assert matcher.declares(flair) == expected, (pronouns, flair)
+
+
+def test_matcher_stats():
+    matcher = FlairMatcher(["she", "her", "they", "them"], False)
+    assert matcher.declares("She/Her")
+    assert matcher.declares("She/Her")
+    assert not matcher.declares("just a flair")
+    stats = matcher.stats()
+    assert (stats['cache_hits'], stats['cache_misses']) == (1, 2)
+    matcher.declares("just a flair")
+    assert matcher.stats(since=stats)['cache_hits'] == 1
@@ -0,0 +1,105 @@
+import io
+import random
+
+import pytest
+
+from n_machine import readers
+from n_machine.readers import LineReader, PrefetchStream
+
+
+class Pipe(io.RawIOBase):
+    """A stream that cannot be seeked and hands out short reads, as the output of a decompressor or an external tool does."""
+
+    def __init__(self, data: bytes, rng: random.Random):
+        self.data = io.BytesIO(data)
+        self.rng = rng
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, view) -> int:
+        return self.data.readinto(view[:self.rng.randint(1, max(1, len(view)))])
+
+    def tell(self) -> int:
+        return self.data.tell()
+
+
+def random_data(rng: random.Random, final_newline: bool) -> bytes:
+    """Lines of random lengths, some empty and some far longer than the buffer, with or without a line break at the end."""
+    lines = [b"x" * rng.choice([0, 1, 2, 5, 7, 30, 100]) + str(i).encode() * rng.randrange(2) for i in range(200)]
+    data = b"\n".join(lines)
+    return data + b"\n" if final_newline else data
+
+
+def expected_lines(data: bytes) -> list:
+    return [line for line in data.split(b"\n") if line]
+
+
+def read(stream, chunk_size: int, start_offset: int = 0, file_handle=None) -> tuple:
+    """Read all lines, returning them together with the decompressed offset reported after each."""
+    reader = LineReader(stream, file_handle, chunk_size, start_offset)
+    lines, offsets = list(), list()
+    for line in reader:
+        lines.append(line)
+        offsets.append(reader.decompressed_offset)
+    return lines, offsets
+
+
+@pytest.fixture(autouse=True)
+def small_window(monkeypatch):
+    # windows much smaller than the buffer, so that complete lines are split in several of them
+    monkeypatch.setattr(readers, "SPLIT_WINDOW", 4)
+
+
+@pytest.mark.parametrize("final_newline", [True, False])
+@pytest.mark.parametrize("chunk_size", [1, 3, 8, 64, 4096])
+def test_lines_match_split(chunk_size, final_newline):
+    for seed in range(5):
+        data = random_data(random.Random(seed), final_newline)
+        lines, offsets = read(io.BytesIO(data), chunk_size)
+        assert lines == expected_lines(data)
+        assert offsets[-1] == len(data.rstrip(b"\n")) + (1 if final_newline else 0)
+        lines, _ = read(Pipe(data, random.Random(seed)), chunk_size)
+        assert lines == expected_lines(data)
+
+
+def test_buffer_grows_for_long_lines():
+    data = b"short\n" + b"y" * 1000 + b"\nend"
+    assert read(io.BytesIO(data), 4)[0] == [b"short", b"y" * 1000, b"end"]
+    assert read(io.BytesIO(b"z" * 100), 4)[0] == [b"z" * 100]
+
+
+def test_empty_stream():
+    assert read(io.BytesIO(b""), 8) == ([], [])
+    assert read(io.BytesIO(b"\n\n\n"), 8) == ([], [])
+
+
+@pytest.mark.parametrize("final_newline", [True, False])
+@pytest.mark.parametrize("chunk_size", [3, 16, 4096])
+def test_resume_from_every_offset(chunk_size, final_newline):
+    data = random_data(random.Random(chunk_size), final_newline)
+    lines, offsets = read(io.BytesIO(data), chunk_size)
+    for i, offset in enumerate(offsets):
+        # plain files are seeked to the offset, other streams are read up to it
+        assert read(io.BytesIO(data), chunk_size, offset)[0] == lines[i + 1:]
+        assert read(Pipe(data, random.Random(i)), chunk_size, offset)[0] == lines[i + 1:]
+        resumed = read(io.BytesIO(data), chunk_size, offset)[1]
+        assert resumed == offsets[i + 1:]
+
+
+def test_start_offset_past_the_end():
+    with pytest.raises(EOFError):
+        read(Pipe(b"a\nb\n", random.Random(0)), 8, 10)
+
+
+@pytest.mark.parametrize("chunk_size", [3, 4096])
+def test_prefetched_lines_match_split(chunk_size):
+    data = random_data(random.Random(1), False)
+    for start_offset in [0, read(io.BytesIO(data), chunk_size)[1][50]]:
+        stream = io.BytesIO(data)
+        prefetch = PrefetchStream(stream, stream, depth=2, chunk_size=5)
+        try:
+            lines, _ = read(prefetch, chunk_size, start_offset)
+        finally:
+            prefetch.close()
+        assert lines == read(io.BytesIO(data), chunk_size, start_offset)[0]
@@ -0,0 +1,91 @@
+import math
+
+from n_machine.reservoir import RandomStream, Reservoir
+
+
+def inclusion_chi2(k: int, n: int, trials: int, subreddit: str = None) -> tuple:
+    """Sample k of n items in many independent reservoirs, returning the chi-squared statistic of how often each item was kept and its degrees of freedom."""
+    kept = [0] * n
+    for seed in range(trials):
+        reservoir = Reservoir(k, RandomStream(seed, 2020, 1, subreddit))
+        for item in range(n):
+            reservoir.add(item)
+        for item in reservoir:
+            kept[item] += 1
+    expected = trials * k / n
+    return sum((count - expected) ** 2 / expected for count in kept), n - 1
+
+
+def assert_uniform(k: int, n: int, trials: int, subreddit: str = None):
+    chi2, df = inclusion_chi2(k, n, trials, subreddit)
+    # about 4.5 standard deviations above the mean of the chi-squared distribution
+    assert chi2 < df + 4.5 * math.sqrt(2 * df), (chi2, df)
+
+
+def test_uniform_per_subreddit():
+    assert_uniform(10, 1000, 2000, "sub")
+    assert_uniform(1, 10, 2000, "sub")
+
+
+def test_uniform_global():
+    assert_uniform(5, 50, 2000)
+    assert_uniform(3, 4, 2000)
+
+
+def test_n_counts_every_item():
+    reservoir = Reservoir(5, RandomStream(0, 2020, 1))
+    for item in range(3):
+        reservoir.add(item)
+    # the items seen while the reservoir fills up count too
+    assert reservoir.n == 3
+    assert list(reservoir) == [0, 1, 2]
+    for item in range(3, 100):
+        reservoir.add(item)
+    assert reservoir.n == 100
+    assert len(reservoir) == 5
+
+
+def test_empty_reservoir_counts_items():
+    reservoir = Reservoir(0, RandomStream(0, 2020, 1))
+    for item in range(10):
+        assert not reservoir.add(item)
+    assert reservoir.n == 10
+    assert len(reservoir) == 0
+
+
+def test_place_returns_replaced_item():
+    reservoir = Reservoir(3, RandomStream(0, 2020, 1))
+    for item in range(3):
+        slot = reservoir.consider()
+        assert slot == item
+        assert reservoir.place(slot, item) is None
+    replaced = 0
+    for item in range(3, 1000):
+        slot = reservoir.consider()
+        if slot is None:
+            continue
+        before = reservoir.items[slot]
+        assert reservoir.place(slot, item) == before
+        assert reservoir.items[slot] == item
+        replaced += 1
+    assert replaced > 0
+    assert len(reservoir) == 3
+
+
+def test_streams_are_reproducible():
+    first, second = RandomStream(7, 2020, 1, "sub"), RandomStream(7, 2020, 1, "sub")
+    draws = [first.random() for _ in range(100)]
+    assert draws == [second.random() for _ in range(100)]
+    assert draws != [RandomStream(7, 2020, 1, "other").random() for _ in range(100)]
+    assert draws != [RandomStream(7, 2020, 2, "sub").random() for _ in range(100)]
+    assert draws != [RandomStream(8, 2020, 1, "sub").random() for _ in range(100)]
+
+
+def test_samples_are_reproducible():
+    samples = list()
+    for _ in range(2):
+        reservoir = Reservoir(10, RandomStream(3, 2021, 5, "sub"))
+        for item in range(5000):
+            reservoir.add(item)
+        samples.append(list(reservoir))
+    assert samples[0] == samples[1]
@@ -0,0 +1,60 @@
+import os
+import glob
+
+import pytest
+
+from n_machine import main as n_machine
+from n_machine.checkpoints import MonthCheckpoint
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(monkeypatch, saves: int) -> list:
+    """Make the month stop right after its checkpoint was saved a number of times."""
+    saved = [0]
+    save = MonthCheckpoint.save
+
+    def save_and_interrupt(self, snapshot):
+        save(self, snapshot)
+        saved[0] += 1
+        if saved[0] == saves:
+            raise Interrupted
+    monkeypatch.setattr(MonthCheckpoint, "save", save_and_interrupt)
+    return saved
+
+
+@pytest.mark.parametrize("options", [[], ['--reservoir_memory_mb', '0.01'], ['--decode_workers', '2', '--block_size', '500']],
+                         ids=["plain", "spilling", "decode workers"])
+@pytest.mark.parametrize("saves", [1, 3])
+def test_resume_matches_uninterrupted_run(synthetic_month, resources, make_args, outputs, monkeypatch, tmp_path, options, saves):
+    input_dir, month = os.path.split(synthetic_month)
+    options = ['--baseline_nr', '1', '2', '--popularity', '0', *options]
+
+    uninterrupted = tmp_path / "uninterrupted"
+    uninterrupted.mkdir()
+    n_machine.run_month(month, make_args(input_dir, str(uninterrupted), *options))
+
+    resumed = tmp_path / "resumed"
+    resumed.mkdir()
+    with monkeypatch.context() as patch:
+        saved = interrupt_after(patch, saves)
+        with pytest.raises(Interrupted):
+            n_machine.run_month(month, make_args(input_dir, str(resumed), *options, '--checkpoint_interval', '1e-9'))
+        assert saved[0] == saves
+    snapshots = list()
+    process_month = n_machine.process_month
+
+    def resume(month, args, checkpoint=None, snapshot=None):
+        snapshots.append(snapshot)
+        return process_month(month, args, checkpoint, snapshot)
+    monkeypatch.setattr(n_machine, "process_month", resume)
+    n_machine.run_month(month, make_args(input_dir, str(resumed), *options))
+    # the month went on from where it was interrupted rather than starting over
+    assert snapshots[0] is not None and snapshots[0]['decompressed_offset'] > 0
+
+    expected = outputs(str(uninterrupted))
+    assert set(expected) == {"baseline-1", "baseline-2"}
+    assert outputs(str(resumed)) == expected
+    assert not glob.glob(os.path.join(str(resumed), "*.spill"))
@@ -0,0 +1,77 @@
+import re
+import random
+import itertools
+
+from n_machine import main as n_machine
+from n_machine.reservoir import bernoulli_sample
+
+
+def old_inside_quote(text: str, span: tuple) -> bool:
+    """inside_quote() as it was before quote_spans(), which searched the text up to each match."""
+    end = span[1]
+    relevant_text = text[:end]
+    return True if re.search('&gt;[^\n]+$', relevant_text) else False
+
+
+def test_inside_quote_matches_old_search():
+    rng = random.Random(0)
+    pieces = ["a", "b", " ", "\n", "\n\n", "&gt;", "&", "gt;", ">", "&gt;\n"]
+    for _ in range(2000):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randrange(12)))
+        quotes = n_machine.quote_spans(text)
+        for start, end in itertools.combinations_with_replacement(range(len(text) + 1), 2):
+            assert n_machine.inside_quote(quotes, (start, end)) == old_inside_quote(text, (start, end)), (text, start, end)
+
+
+def test_matching_spans_leaves_out_quotes(resources, make_args, tmp_path):
+    text = "&gt;they said pronoun\n\npronoun again &gt;pronoun"
+    args = make_args(str(tmp_path), str(tmp_path), '--commentregex', 'pronoun')
+    assert list(n_machine.matching_spans(text, args)) == [(23, 30)]
+    args = make_args(str(tmp_path), str(tmp_path), '--commentregex', 'pronoun', '--include_quoted')
+    assert list(n_machine.matching_spans(text, args)) == [(14, 21), (23, 30), (41, 48)]
+
+
+def relevant_comment(resources, **fields) -> dict:
+    """A comment that passes all filters of baseline 1, with some of its fields changed."""
+    author = next(f"user{i}" for i in itertools.count() if f"user{i}" not in resources.userlist)
+    comment = {'body': "hello there", 'author': author, 'author_flair_text': None, 'subreddit': resources.subs[0], 'score': 5,
+               'created_utc': 0, 'link_id': "t3_a", 'id': "c1", 'permalink': None, 'parent_id': "t3_a"}
+    comment.update(fields)
+    return comment
+
+
+def reason(comment: dict, args) -> str:
+    return n_machine.rejection_reason(comment, args, n_machine.resources.subs, 1)
+
+
+def test_toplevel_reason(resources, make_args, tmp_path):
+    args = make_args(str(tmp_path), str(tmp_path), '--toplevel')
+    assert reason(relevant_comment(resources, parent_id="t3_a"), args) is None
+    assert reason(relevant_comment(resources, parent_id="t1_b"), args) == 'toplevel'
+    assert reason(relevant_comment(resources, parent_id=None), args) == 'toplevel'
+    assert reason(relevant_comment(resources, parent_id="t1_b"), make_args(str(tmp_path), str(tmp_path))) is None
+    # the subreddit is tested first
+    assert reason(relevant_comment(resources, parent_id="t1_b", subreddit="not declared"), args) == 'subreddit'
+
+
+def test_sample_reason(resources, make_args, tmp_path):
+    args = make_args(str(tmp_path), str(tmp_path), '--sample', '0.3', '--seed', '5')
+    reasons = [reason(relevant_comment(resources, id=f"c{i}"), args) for i in range(4000)]
+    assert set(reasons) == {None, 'sample'}
+    assert reasons == [None if bernoulli_sample(f"c{i}", 5, 0.3) else 'sample' for i in range(4000)]
+    assert abs(reasons.count(None) / len(reasons) - 0.3) < 0.03
+    none = make_args(str(tmp_path), str(tmp_path), '--sample', '0')
+    assert reason(relevant_comment(resources), none) == 'sample'
+    everything = make_args(str(tmp_path), str(tmp_path), '--sample', '1')
+    assert reason(relevant_comment(resources), everything) is None
+
+
+def test_regex_reason(resources, make_args, tmp_path):
+    args = make_args(str(tmp_path), str(tmp_path), '--commentregex', 'pronouns?')
+    assert reason(relevant_comment(resources, body="my pronouns are"), args) is None
+    assert reason(relevant_comment(resources, body="nothing here"), args) == 'regex'
+    assert reason(relevant_comment(resources, body="&gt;my pronouns are\n\nnothing here"), args) == 'regex'
+    quoted = make_args(str(tmp_path), str(tmp_path), '--commentregex', 'pronouns?', '--include_quoted')
+    assert reason(relevant_comment(resources, body="&gt;my pronouns are\n\nnothing here"), quoted) is None
+    # cheaper filters come before the regex
+    assert reason(relevant_comment(resources, body="nothing here, I'm a bot"), args) == 'bot'
@@ -0,0 +1,43 @@
+import os
+import glob
+
+import pytest
+
+from n_machine import main as n_machine
+from n_machine.spill import SpillFile
+
+
+def count_spilled(monkeypatch) -> list:
+    """Record how many comments each spill file held when it was closed."""
+    spilled = list()
+    close = SpillFile.close
+
+    def record_and_close(self):
+        spilled.append(self.spilled)
+        close(self)
+    monkeypatch.setattr(SpillFile, "close", record_and_close)
+    return spilled
+
+
+@pytest.mark.parametrize("options", [[], ['--decode_workers', '2', '--block_size', '500'], ['--return_all', '--output_format', 'jsonl']],
+                         ids=["plain", "decode workers", "whole comments"])
+@pytest.mark.parametrize("cap", ['0', '0.01', '0.1'])
+def test_spilling_matches_memory(synthetic_month, resources, make_args, outputs, monkeypatch, tmp_path, options, cap):
+    input_dir, month = os.path.split(synthetic_month)
+    options = ['--baseline_nr', '1', '2', '--popularity', '0', *options]
+
+    in_memory = tmp_path / "in_memory"
+    in_memory.mkdir()
+    n_machine.run_month(month, make_args(input_dir, str(in_memory), *options))
+
+    spilling = tmp_path / "spilling"
+    spilling.mkdir()
+    spilled = count_spilled(monkeypatch)
+    n_machine.run_month(month, make_args(input_dir, str(spilling), *options, '--reservoir_memory_mb', cap))
+    # both baselines had to spill some of their comments
+    assert len(spilled) == 2 and all(spilled)
+
+    expected = outputs(str(in_memory))
+    assert set(expected) == {"baseline-1", "baseline-2"}
+    assert outputs(str(spilling)) == expected
+    assert not glob.glob(os.path.join(str(spilling), "*.spill"))
@@ -0,0 +1,24 @@
+import os
+import json
+import glob
+
+import pytest
+
+from n_machine import main as n_machine
+from n_machine.stats import STATS_FILE_ENDING, STATS_FILE_PREFIX
+
+
+@pytest.mark.parametrize("options", [[], ['--decode_workers', '2', '--block_size', '500']], ids=["plain", "decode workers"])
+def test_stats_file(synthetic_month, resources, make_args, tmp_path, options):
+    input_dir, month = os.path.split(synthetic_month)
+    outfiles = n_machine.run_month(month, make_args(input_dir, str(tmp_path), '--baseline_nr', '1', '2', '--popularity', '0', *options))
+    assert glob.glob(os.path.join(str(tmp_path), f"{STATS_FILE_PREFIX}*{STATS_FILE_ENDING}")) == [outfiles['stats']]
+    with open(outfiles['stats'], encoding="utf-8") as infile:
+        report = json.load(infile)
+    assert report['month'] == month
+    assert report['counters']['lines'] == 20000
+    # the flair matcher stats are those of this month alone, however many decode workers looked the flairs up
+    matcher = report['flair_matcher']
+    assert matcher['cache_hits'] + matcher['cache_misses'] > 0
+    for name in ("baseline-1", "baseline-2"):
+        assert sum(report['rejections'][name].values()) == report['counters']['lines']
@@ -0,0 +1,32 @@
+import sys
+import subprocess
+
+import pytest
+
+from n_machine.writers import COLUMNS, check_format, open_writer
+
+
+ROWS = [("some text", "(0, 4)", "sub", 5, "user", None, 1600000000, "/r/sub/1"),
+        ("more text", "(1, 3)", "other", -2, "user2", "flair", "1600000001", None)]
+
+
+def test_pyarrow_is_imported_lazily():
+    code = "import sys, n_machine.main; print('pyarrow' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip() == "False"
+
+
+@pytest.mark.parametrize("output_format", ['parquet', 'arrow'])
+def test_columnar_formats(tmp_path, output_format):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    import pyarrow.parquet
+    check_format(output_format)
+    path = str(tmp_path / f"out.{output_format}")
+    with open_writer(path, output_format) as writer:
+        for row in ROWS:
+            writer.write_row(row)
+    table = pa.parquet.read_table(path) if output_format == 'parquet' else pa.ipc.open_file(path).read_all()
+    assert table.column_names == COLUMNS
+    # dates that are strings in some of the older dumps are written as ints
+    assert table.column('date').to_pylist() == [1600000000, 1600000001]
+    assert table.column('text').to_pylist() == ["some text", "more text"]